@@ -0,0 +1,281 @@
+# Асинхронная (серверная) часть IPC. Вынесена из ipc, чтобы клиентам командной строки
+# не приходилось импортировать asyncio
+import os
+import asyncio
+import itertools
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from ipc import (CODECS, HELLO_KEY, ENCODING_KEY, ERROR_KEY, IPCError, ConnectionClosed, _pack_objects,
+                 _choose_encoding, _frame_size)
+
+
+async def _read_objects_async(reader, encoding='json'):
+    try:
+        size = _frame_size(await reader.readexactly(4))
+        data = await reader.readexactly(size - 4)
+    except asyncio.IncompleteReadError:
+        raise ConnectionClosed()
+    return CODECS[encoding][1](data)
+
+
+# Асинхронный клиент: запросы по одному соединению идут конвейером, ответы сопоставляются по req_id
+class AsyncClient:
+    def __init__(self, server_address, encoding='json'):
+        self.addr = server_address
+        self.encoding = encoding
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        # Кадры подписки (ответы без req_id)
+        self.frames = asyncio.Queue()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.addr)
+        if self.encoding not in CODECS:
+            self.encoding = 'json'
+        if self.encoding != 'json':
+            self._writer.write(_pack_objects({HELLO_KEY: [self.encoding, 'json']}))
+            self.encoding = (await _read_objects_async(self._reader))[ENCODING_KEY]
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            await self._writer.wait_closed()
+        if self._read_task:
+            await self._read_task
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def send(self, objects):
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        self._writer.write(_pack_objects(dict(objects, req_id=req_id), self.encoding))
+        await self._writer.drain()
+        return await fut
+
+    async def _read_loop(self):
+        try:
+            while True:
+                response = await _read_objects_async(self._reader, self.encoding)
+                if not isinstance(response, dict) or 'req_id' not in response:
+                    self.frames.put_nowait(response)
+                    continue
+                fut = self._pending.pop(response['req_id'], None)
+                if fut and not fut.done():
+                    if ERROR_KEY in response:
+                        fut.set_exception(IPCError(response[ERROR_KEY]))
+                    else:
+                        fut.set_result(response['result'])
+        except (ConnectionClosed, ConnectionError):
+            pass
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionClosed())
+            self._pending.clear()
+
+
+# Подписка на поток кадров. Возвращается callback'ом сервера вместо обычного ответа:
+# клиенту уходит ack, после чего соединение получает кадры из Server.publish().
+# interval - минимальный интервал между кадрами (сек), accept(frame, last_frame) - фильтр кадров,
+# topic - поток кадров (Server.publish(frame, topic)), queue > 0 - не заменять неотправленный кадр новым,
+# а копить до queue кадров (для событий, которые нельзя терять)
+class Subscription:
+    def __init__(self, ack=None, interval=0.0, accept=None, topic='position', queue=0):
+        self.ack = ack
+        self.interval = interval
+        self.accept = accept
+        self.topic = topic
+        self.sent = 0
+        self.dropped = 0
+        self._last_frame = None
+        self._last_ts = 0.0
+        self._pending = None
+        self._queue = deque(maxlen=queue) if queue > 0 else None
+        self._event = None
+
+    # Вызывается в цикле событий сервера для каждого опубликованного кадра
+    def _offer(self, frame, ts):
+        if ts - self._last_ts < self.interval:
+            return
+        if self.accept and self._last_frame is not None and not self.accept(frame, self._last_frame):
+            return
+        self._last_frame = frame
+        self._last_ts = ts
+        if self._queue is not None:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(frame)
+            self._event.set()
+            return
+        # Не успевший уйти кадр заменяется новым, медленный подписчик не тормозит остальных
+        if self._pending is not None:
+            self.dropped += 1
+        self._pending = frame
+        self._event.set()
+
+
+# Unix-сокет сервер на asyncio: много одновременных соединений, запросы с req_id обрабатываются
+# параллельно и отвечают по мере готовности, блокирующий callback выполняется в пуле потоков
+class Server:
+    def __init__(self, server_address, callback, workers=8):
+        self.addr = server_address
+
+        if not callable(callback):
+            callback = lambda x: []
+        self.callback = callback
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ipc')
+        self._loop = None
+        self._stop = None
+        self._subs = set()
+        # Число подписчиков по topic: меняется только в цикле событий, читается из любого потока
+        self._topics = Counter()
+        self._sub_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server_close()
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    # Можно вызывать из любого потока
+    def shutdown(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    # Число подписчиков topic (None - всех). Можно вызывать из любого потока
+    def subscribers(self, topic=None):
+        return self._sub_count if topic is None else self._topics.get(topic, 0)
+
+    # Можно вызывать из любого потока
+    def has_subscribers(self, topic='position'):
+        return self.subscribers(topic) > 0
+
+    # Разослать кадр всем подписчикам topic. Можно вызывать из любого потока
+    def publish(self, frame, topic='position'):
+        if self._loop and self._subs:
+            try:
+                self._loop.call_soon_threadsafe(self._fan_out, frame, topic)
+            except RuntimeError:  # цикл событий уже закрыт
+                pass
+
+    def server_close(self):
+        self._executor.shutdown(wait=False)
+        try:
+            os.unlink(self.addr)
+        except OSError:
+            if os.path.exists(self.addr):
+                raise
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_unix_server(self._handle, path=self.addr)
+        async with server:
+            await self._stop.wait()
+
+    def _add_sub(self, sub):
+        self._subs.add(sub)
+        self._topics[sub.topic] += 1
+        self._sub_count += 1
+
+    def _remove_sub(self, sub):
+        if sub in self._subs:
+            self._subs.discard(sub)
+            self._topics[sub.topic] -= 1
+            self._sub_count -= 1
+
+    def _fan_out(self, frame, topic):
+        ts = self._loop.time()
+        for sub in self._subs:
+            if sub.topic == topic:
+                sub._offer(frame, ts)
+
+    async def _stream(self, sub, writer, encoding):
+        try:
+            while True:
+                await sub._event.wait()
+                sub._event.clear()
+                if sub._queue is not None:
+                    frames = list(sub._queue)
+                    sub._queue.clear()
+                else:
+                    frames, sub._pending = [sub._pending], None
+                for frame in frames:
+                    writer.write(_pack_objects(frame, encoding))
+                sub.sent += len(frames)
+                await writer.drain()
+        except ConnectionError:
+            self._remove_sub(sub)
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        streams = []
+        encoding = 'json'
+        first = True
+        try:
+            while True:
+                try:
+                    req = await _read_objects_async(reader, encoding)
+                except (ConnectionClosed, ConnectionError):
+                    break
+                if first and isinstance(req, dict) and HELLO_KEY in req:
+                    first = False
+                    chosen = _choose_encoding(req[HELLO_KEY])
+                    writer.write(_pack_objects({ENCODING_KEY: chosen}))
+                    encoding = chosen
+                    continue
+                first = False
+                if isinstance(req, dict) and 'req_id' in req:
+                    task = asyncio.ensure_future(self._process(req, writer, encoding, streams))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    # Запросы без req_id обрабатываем строго по порядку
+                    await self._process(req, writer, encoding, streams)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for sub, task in streams:
+                self._remove_sub(sub)
+                task.cancel()
+            writer.close()
+
+    async def _process(self, req, writer, encoding, streams):
+        req_id = req.pop('req_id', None) if isinstance(req, dict) else None
+        try:
+            result = await self._loop.run_in_executor(self._executor, self.callback, req)
+        except Exception as e:
+            # Ошибка обработчика уходит клиенту кадром ошибки, соединение и остальные запросы по нему живут
+            error = {ERROR_KEY: f'{type(e).__name__}: {e}'}
+            if req_id is not None:
+                error['req_id'] = req_id
+            writer.write(_pack_objects(error, encoding))
+            await writer.drain()
+            return
+        if isinstance(result, Subscription):
+            sub = result
+            sub._event = asyncio.Event()
+            sub._last_frame = sub.ack
+            sub._last_ts = self._loop.time()
+            self._add_sub(sub)
+            streams.append((sub, asyncio.ensure_future(self._stream(sub, writer, encoding))))
+            result = sub.ack
+        if req_id is not None:
+            result = {'req_id': req_id, 'result': result}
+        writer.write(_pack_objects(result, encoding))
+        await writer.drain()
@@ -0,0 +1,55 @@
+# Время импорта клиентской части locd (python -X importtime) и проверка, что тяжелые модули
+# демона не попадают в клиентский путь. Код возврата 1, если попали или превышен бюджет.
+# Запуск: python bench/bench_import.py [-r 5] [--budget-ms 60]
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые нужны только демону
+HEAVY_MODULES = ['pyproj', 'openrouteservice', 'requests', 'daemon', 'lockfile', 'asyncio', 'numpy', 'sqlite3',
+                 'location', 'routecache', 'routing', 'aioipc']
+
+
+# Возвращает {модуль: накопленное время импорта (мкс)} для верхнего уровня
+def _importtime(module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def run(repeat):
+    totals = []
+    imported = set()
+    for _ in range(repeat):
+        times = _importtime('locd')
+        totals.append(times['locd'])
+        imported.update(times)
+    heavy = sorted(mod for mod in HEAVY_MODULES if mod in imported)
+    return {'module': 'locd',
+            'repeat': repeat,
+            'median_ms': statistics.median(totals) / 1000,
+            'min_ms': min(totals) / 1000,
+            'heavy_modules': heavy}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Client import-time benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='(Default: %(default)s)')
+    parser.add_argument('--budget-ms', type=float, default=60, help='Max median import time of locd '
+                                                                    '(Default: %(default)s)')
+    args = parser.parse_args()
+    result = run(args.repeat)
+    print(json.dumps(result))
+    if result['heavy_modules'] or result['median_ms'] > args.budget_ms:
+        sys.exit(1)
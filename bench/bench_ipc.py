@@ -0,0 +1,80 @@
+# Нагрузочный тест aioipc.Server: N одновременных клиентов опрашивают 'cur' в течение заданного времени
+# Запуск: python bench/bench_ipc.py [-c 100] [-d 5] [-p 1]
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aioipc
+import location
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def _poller(sockf, deadline, pipeline, latencies):
+    async with aioipc.AsyncClient(sockf) as client:
+        async def one():
+            while time.perf_counter() < deadline:
+                ts = time.perf_counter()
+                await client.send({'cmd': 'cur'})
+                latencies.append(time.perf_counter() - ts)
+        await asyncio.gather(*[one() for _ in range(pipeline)])
+
+
+async def _load(sockf, clients, duration, pipeline):
+    latencies = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[_poller(sockf, deadline, pipeline, latencies) for _ in range(clients)])
+    return latencies
+
+
+def run(clients, duration, pipeline):
+    tracker = location.Tracker(55.793913, 37.788678)
+    lock = threading.Lock()
+
+    def handler(req):
+        with lock:
+            return {'cur_loc': tracker.accurate_loc().pos}
+
+    sockf = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+    server = aioipc.Server(sockf, handler)
+    thrd = threading.Thread(target=server.serve_forever, daemon=True)
+    thrd.start()
+    while not os.path.exists(sockf):
+        time.sleep(0.01)
+
+    try:
+        latencies = asyncio.run(_load(sockf, clients, duration, pipeline))
+    finally:
+        server.shutdown()
+        thrd.join()
+        server.server_close()
+
+    return {'clients': clients,
+            'pipeline': pipeline,
+            'duration': duration,
+            'requests': len(latencies),
+            'req_per_sec': len(latencies) / duration,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='IPC server load test')
+    parser.add_argument('-c', '--clients', type=int, default=100, help='Concurrent pollers (Default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=float, default=5, help='Seconds (Default: %(default)s)')
+    parser.add_argument('-p', '--pipeline', type=int, default=1, help='In-flight requests per connection '
+                                                                       '(Default: %(default)s)')
+    args = parser.parse_args()
+    print(json.dumps(run(args.clients, args.duration, args.pipeline)))
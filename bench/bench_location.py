@@ -0,0 +1,48 @@
+# Микро-бенчмарк location.Location: сколько точек в секунду создается и смещается
+# Запуск: python bench/bench_location.py [-n 20000]
+import os
+import sys
+import time
+import json
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import location
+
+
+def _rate(func, n):
+    ts = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n / (time.perf_counter() - ts)
+
+
+def run(n):
+    lat, lon = 55.793913, 37.788678
+    loc = location.Location(lat, lon)
+
+    def create():
+        location.Location(lat, lon)
+
+    def fwd():
+        loc.fwd(91.5, 10.0)
+
+    # То же, что делает Tracker.noised_loc
+    def noise():
+        fake_loc = location.Location(lat, lon)
+        fake_loc.x = random.gauss(fake_loc.x, 0.5)
+        fake_loc.y = random.gauss(fake_loc.y, 0.5)
+
+    return {'n': n,
+            'create_per_sec': _rate(create, n),
+            'fwd_per_sec': _rate(fwd, n),
+            'noised_per_sec': _rate(noise, n)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Location micro-benchmark')
+    parser.add_argument('-n', type=int, default=20000, help='Iterations per case (Default: %(default)s)')
+    args = parser.parse_args()
+    print(json.dumps(run(args.n)))
@@ -0,0 +1,59 @@
+# Бенчмарк pool.TrackerPool: тиков в секунду для N трекеров с синтетическими маршрутами
+# Запуск: python bench/bench_pool.py [-n 10000] [-p 200] [-t 50]
+import os
+import sys
+import time
+import json
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pool
+
+
+# Ломаная из points точек с шагом step метров в случайных направлениях
+def _synthetic_track(rng, lat, lon, points, step=20.0):
+    az = np.cumsum(rng.uniform(-30, 30, points)) + rng.uniform(0, 360)
+    track = []
+    for a in az:
+        lon, lat, _ = pool._geod.fwd(lon, lat, a, step)
+        track.append((lat, lon))
+    return track
+
+
+def run(n, points, ticks, tick_sec=0.5):
+    rng = np.random.default_rng(1)
+    lats = 55.75 + rng.uniform(-0.1, 0.1, n)
+    lons = 37.6 + rng.uniform(-0.1, 0.1, n)
+    trackers = pool.TrackerPool(lats, lons)
+
+    ts = time.perf_counter()
+    for i in range(n):
+        trackers.set_route(i, _synthetic_track(rng, lats[i], lons[i], points), speed=rng.uniform(3, 60))
+    setup = time.perf_counter() - ts
+
+    sim_ts = float(trackers.sync_time[0])
+    ts = time.perf_counter()
+    for _ in range(ticks):
+        sim_ts += tick_sec
+        trackers.step(sim_ts)
+    elapsed = time.perf_counter() - ts
+
+    return {'trackers': n,
+            'points_per_route': points,
+            'ticks': ticks,
+            'setup_sec': setup,
+            'ticks_per_sec': ticks / elapsed,
+            'tracker_updates_per_sec': ticks * n / elapsed,
+            'moving_at_end': int(np.sum(trackers.off >= 0))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TrackerPool benchmark')
+    parser.add_argument('-n', '--trackers', type=int, default=10000, help='(Default: %(default)s)')
+    parser.add_argument('-p', '--points', type=int, default=200, help='Points per route (Default: %(default)s)')
+    parser.add_argument('-t', '--ticks', type=int, default=50, help='(Default: %(default)s)')
+    args = parser.parse_args()
+    print(json.dumps(run(args.trackers, args.points, args.ticks)))
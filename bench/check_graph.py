@@ -0,0 +1,131 @@
+# Проверка routing.GraphBackend на синтетической сетке N x N (со случайным сдвигом вершин и без части ребер):
+# длины путей A* (shortest_path) сравниваются с обычной Дейкстрой по тем же CSR-массивам, а nearest -
+# с перебором всех вершин. Расхождение длин означает, что эвристика A* переоценивает расстояние.
+# Код возврата 1 при любом расхождении.
+# Запуск: python bench/check_graph.py [-n 40] [--pairs 200] [--points 500] [--seed 1]
+import os
+import sys
+import json
+import math
+import heapq
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing
+
+START = (55.7939, 37.7887)
+# Шаг сетки (градусы): несколько вершин на ячейку GraphBackend.CELL
+STEP = 0.003
+
+
+def make_grid(n, rng, drop=0.1):
+    lats, lons = [], []
+    for i in range(n):
+        for j in range(n):
+            lats.append(START[0] + i * STEP + rng.uniform(-0.3, 0.3) * STEP)
+            lons.append(START[1] + j * STEP + rng.uniform(-0.3, 0.3) * STEP)
+    edges = []
+    for i in range(n):
+        for j in range(n):
+            u = i * n + j
+            for v in ((u + 1) if j + 1 < n else None, (u + n) if i + 1 < n else None):
+                if v is None or rng.random() < drop:
+                    continue
+                edges.append((u, v))
+                # Часть ребер односторонние
+                if rng.random() > drop:
+                    edges.append((v, u))
+    return routing.GraphBackend(lats, lons, edges)
+
+
+# Длина кратчайшего пути без эвристики, None - пути нет
+def dijkstra(graph, src, dst):
+    dist = {src: 0.0}
+    heap = [(0.0, src)]
+    while heap:
+        du, u = heapq.heappop(heap)
+        if u == dst:
+            return du
+        if du > dist[u]:
+            continue
+        for pos in range(graph.indptr[u], graph.indptr[u + 1]):
+            v = graph.indices[pos]
+            dv = du + graph.weights[pos]
+            if dv < dist.get(v, math.inf):
+                dist[v] = dv
+                heapq.heappush(heap, (dv, v))
+    return None
+
+
+def path_length(graph, path):
+    total = 0.0
+    for u, v in zip(path, path[1:]):
+        total += min(graph.weights[pos] for pos in range(graph.indptr[u], graph.indptr[u + 1])
+                     if graph.indices[pos] == v)
+    return total
+
+
+def check_paths(graph, pairs, rng):
+    errors = []
+    for _ in range(pairs):
+        src, dst = rng.randrange(len(graph)), rng.randrange(len(graph))
+        expected = dijkstra(graph, src, dst)
+        try:
+            path = graph.shortest_path(src, dst)
+        except routing.RoutingError:
+            path = None
+        if expected is None or path is None:
+            if (expected is None) != (path is None):
+                errors.append({'src': src, 'dst': dst, 'dijkstra': expected, 'astar': path})
+            continue
+        assert path[0] == src and path[-1] == dst
+        length = path_length(graph, path)
+        if abs(length - expected) > 1e-6 * max(expected, 1.0):
+            errors.append({'src': src, 'dst': dst, 'dijkstra': expected, 'astar': length})
+    return errors
+
+
+def check_nearest(graph, points, rng, n):
+    errors = []
+    span = n * STEP
+    for _ in range(points):
+        # Точки и внутри сетки, и вокруг нее (поиск по нескольким кольцам ячеек)
+        lat = START[0] + rng.uniform(-0.5, 1.5) * span
+        lon = START[1] + rng.uniform(-0.5, 1.5) * span
+        node = graph.nearest(lat, lon)
+        best = min(graph._heuristic(lat, lon, i) for i in range(len(graph)))
+        if graph._heuristic(lat, lon, node) > best + 1e-9:
+            errors.append({'point': (lat, lon), 'nearest': node, 'dist': graph._heuristic(lat, lon, node),
+                           'best': best})
+    return errors
+
+
+def run(n, pairs, points, seed):
+    rng = random.Random(seed)
+    graph = make_grid(n, rng)
+    path_errors = check_paths(graph, pairs, rng)
+    nearest_errors = check_nearest(graph, points, rng, n)
+    return {'nodes': len(graph),
+            'edges': len(graph.indices),
+            'pairs': pairs,
+            'points': points,
+            'path_errors': path_errors[:10],
+            'nearest_errors': nearest_errors[:10],
+            'ok': not path_errors and not nearest_errors}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GraphBackend check on a synthetic grid graph')
+    parser.add_argument('-n', '--size', type=int, default=40, help='Grid side (Default: %(default)s)')
+    parser.add_argument('--pairs', type=int, default=200, help='Random shortest path queries '
+                                                               '(Default: %(default)s)')
+    parser.add_argument('--points', type=int, default=500, help='Random nearest node queries '
+                                                                '(Default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='(Default: %(default)s)')
+    args = parser.parse_args()
+    result = run(args.size, args.pairs, args.points, args.seed)
+    print(json.dumps(result))
+    if not result['ok']:
+        sys.exit(1)
@@ -0,0 +1,90 @@
+# Заглушки openrouteservice для бенчмарков: синтетические маршруты заданной длины
+#   StubBackend    - бэкенд routing без сети
+#   FakeORSServer  - локальный HTTP-сервер с API /v2/directions/<profile>/json (для routing.ORSBackend)
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing
+
+
+# Encoded polyline из points точек между start и end (lat, lon) с небольшим зигзагом
+def synthetic_geometry(start, end, points):
+    (lat0, lon0), (lat1, lon1) = start, end
+    coords = []
+    for i in range(1, points + 1):
+        k = i / (points + 1)
+        coords.append((lon0 + (lon1 - lon0) * k, lat0 + (lat1 - lat0) * k + (i % 2) * 0.00005))
+    return routing.encode_polyline(coords)
+
+
+class StubBackend:
+    def __init__(self, points=100, delay=0.0):
+        self.points = points
+        self.delay = delay
+        self.calls = 0
+
+    def directions(self, start, end, prof):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return synthetic_geometry(start, end, self.points)
+
+
+class FakeORSServer:
+    def __init__(self, points=100, delay=0.0, status=200, failures=None, retry_after=None):
+        self.points = points
+        self.delay = delay
+        # Код ответа (например, 429 или 503 для проверки повторов): на все запросы или на первые failures
+        self.status = status
+        self.failures = failures
+        # Заголовок Retry-After в ответах с ошибкой (сек)
+        self.retry_after = retry_after
+        self.requests = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                fake.requests += 1
+                failed = fake.status != 200 and (fake.failures is None or fake.requests <= fake.failures)
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                (lon0, lat0), (lon1, lat1) = body['coordinates'][0], body['coordinates'][-1]
+                if fake.delay:
+                    time.sleep(fake.delay)
+                if not failed:
+                    data = {'routes': [{'geometry': synthetic_geometry((lat0, lon0), (lat1, lon1), fake.points)}]}
+                else:
+                    data = {'error': {'code': fake.status, 'message': 'fake error'}}
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(fake.status if failed else 200)
+                self.send_header('Content-Type', 'application/json')
+                if failed and fake.retry_after is not None:
+                    self.send_header('Retry-After', str(fake.retry_after))
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thrd = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thrd.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._httpd.shutdown()
+        self._httpd.server_close()
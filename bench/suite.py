@@ -0,0 +1,253 @@
+# Набор бенчмарков locd, результат - JSON (для сравнения прогонов между собой)
+#   calc_loc - стоимость Tracker._calc_loc в зависимости от длины трека
+#   ipc      - задержки status/cur через сокет демона для N одновременных клиентов
+#   move     - move от запроса до начала движения (ORS - локальный FakeORSServer)
+#   saver    - CPU и число записей FileSaver при публикации положения
+#   ors      - клиент ORS: объединение одинаковых запросов, ограничение частоты, повторы после 429
+# Запуск: python bench/suite.py [-c calc_loc ipc move saver ors] [-o result.json]
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clock
+import ipc
+import aioipc
+import locd
+import location
+import routing
+
+from fake_ors import StubBackend, FakeORSServer
+
+START = (55.793913, 37.788678)
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda pct: values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+    return {'n': len(values), 'p50_ms': pick(50), 'p90_ms': pick(90), 'p99_ms': pick(99), 'max_ms': values[-1] * 1000}
+
+
+def _target(rng, dist=0.02):
+    return START[0] + rng.uniform(-dist, dist), START[1] + rng.uniform(-dist, dist)
+
+
+# Демон в текущем процессе (без DaemonContext): Locd.run в отдельном потоке
+class _InProcessDaemon:
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='locd-bench-')
+        self.sockf = os.path.join(self.dir, 'locd.sock')
+        self.locd = locd.Locd(curf=os.path.join(self.dir, 'cur.txt'), sockf=self.sockf,
+                              shmf=os.path.join(self.dir, 'pos.shm'))
+        self.locd.tracker = location.Tracker(*START)
+        self._thrd = threading.Thread(target=self.locd.run, daemon=True)
+
+    def __enter__(self):
+        self._thrd.start()
+        while not os.path.exists(self.sockf):
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.locd.server.shutdown()
+        self._thrd.join()
+        location.Tracker.planner.shutdown(wait=False)
+        location.Tracker.planner = None
+        location.Tracker.route_cache = None
+
+
+def bench_calc_loc(lengths=(10, 100, 1000, 10000, 100000), calls=2000):
+    results = []
+    for points in lengths:
+        routing.register('ors', StubBackend(points))
+        manual = clock.ManualClock(0.0)
+        tracker = location.Tracker(*START, clock=manual)
+        tracker.move_to(START[0] + 0.2, START[1] + 0.2, speed=60)
+        ts = time.perf_counter()
+        tracker._build_route()
+        build = time.perf_counter() - ts
+        ts = time.perf_counter()
+        for _ in range(calls):
+            manual.advance(0.5)
+            tracker._calc_loc()
+        elapsed = time.perf_counter() - ts
+        results.append({'track_points': points, 'build_ms': build * 1000, 'calc_loc_us': elapsed / calls * 1e6})
+    return results
+
+
+def bench_ipc(clients=(1, 10, 100), duration=2.0, cmds=('cur', 'status')):
+    routing.register('ors', StubBackend(200))
+    results = []
+    with _InProcessDaemon() as daemon:
+        with ipc.Client(daemon.sockf) as client:
+            client.send({'cmd': 'move', 'lat': START[0] + 0.01, 'lon': START[1] + 0.01})
+
+        async def poller(cmd, deadline, latencies):
+            async with aioipc.AsyncClient(daemon.sockf) as client:
+                while time.perf_counter() < deadline:
+                    ts = time.perf_counter()
+                    await client.send({'cmd': cmd})
+                    latencies.append(time.perf_counter() - ts)
+
+        async def load(cmd, n):
+            latencies = []
+            deadline = time.perf_counter() + duration
+            await asyncio.gather(*[poller(cmd, deadline, latencies) for _ in range(n)])
+            return latencies
+
+        for cmd in cmds:
+            for n in clients:
+                latencies = asyncio.run(load(cmd, n))
+                results.append(dict(_percentiles(latencies), cmd=cmd, clients=n,
+                                    req_per_sec=len(latencies) / duration))
+    return results
+
+
+def bench_move(iterations=20, points=500, delay=0.05):
+    rng = random.Random(1)
+    results = {}
+    with FakeORSServer(points=points, delay=delay) as ors, _InProcessDaemon() as daemon:
+        routing.register('ors', routing.ORSBackend('bench', base_url=ors.url, rate=1000, burst=1000))
+        returned, moving = [], []
+        with ipc.Client(daemon.sockf) as client:
+            for _ in range(iterations):
+                lat, lon = _target(rng)
+                ts = time.perf_counter()
+                client.send({'cmd': 'move', 'lat': lat, 'lon': lon})
+                returned.append(time.perf_counter() - ts)
+                while client.send({'cmd': 'status'})['state'] == 'planning':
+                    time.sleep(0.001)
+                moving.append(time.perf_counter() - ts)
+        results['ors_delay_ms'] = delay * 1000
+        results['track_points'] = points
+        results['move_return'] = _percentiles(returned)
+        results['move_to_moving'] = _percentiles(moving)
+        results['ors_requests'] = ors.requests
+    return results
+
+
+def bench_saver(duration=3.0, refresh=0.05):
+    routing.register('ors', StubBackend(500))
+    tmpdir = tempfile.mkdtemp(prefix='locd-bench-')
+    tracker = location.Tracker(*START)
+    tracker.move_to(START[0] + 0.2, START[1] + 0.2, speed=60)
+    saver = locd.FileSaver(os.path.join(tmpdir, 'cur.txt'), tracker, threading.RLock(),
+                           os.path.join(tmpdir, 'pos.shm'))
+
+    orig_refresh = locd.REFRESH_CUR_TIME
+    locd.REFRESH_CUR_TIME = refresh
+    saves = [0]
+    save_once = saver.save_once
+
+    def counted(*args, **kwargs):
+        saves[0] += 1
+        return save_once(*args, **kwargs)
+
+    saver.save_once = counted
+    try:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        ts = time.perf_counter()
+        saver.start()
+        time.sleep(duration)
+        saver.stop()
+        elapsed = time.perf_counter() - ts
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        locd.REFRESH_CUR_TIME = orig_refresh
+
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    return {'refresh_sec': refresh,
+            'saves': saves[0],
+            'cpu_ms_per_sec': cpu / elapsed * 1000,
+            'cpu_us_per_save': cpu / max(saves[0], 1) * 1e6,
+            'vol_ctx_switches': after.ru_nvcsw - usage.ru_nvcsw,
+            'fs_writes_blocks': after.ru_oublock - usage.ru_oublock}
+
+
+def bench_ors(clients=20, rate=10.0, distinct=20, failures=3):
+    results = {}
+    end = (START[0] + 0.01, START[1] + 0.01)
+
+    # clients потоков одновременно запрашивают один и тот же маршрут
+    with FakeORSServer(points=100, delay=0.2) as ors:
+        backend = routing.ORSBackend('bench', base_url=ors.url, rate=1000, burst=1000)
+        thrds = [threading.Thread(target=backend.directions, args=(START, end, 'foot-walking'))
+                 for _ in range(clients)]
+        ts = time.perf_counter()
+        for thrd in thrds:
+            thrd.start()
+        for thrd in thrds:
+            thrd.join()
+        results['coalesce'] = {'clients': clients, 'http_requests': ors.requests,
+                               'elapsed_ms': (time.perf_counter() - ts) * 1000}
+
+    # distinct разных маршрутов при ограничении rate запросов в секунду
+    with FakeORSServer(points=100) as ors:
+        backend = routing.ORSBackend('bench', base_url=ors.url, rate=rate, burst=1)
+        ts = time.perf_counter()
+        for i in range(distinct):
+            backend.directions(START, (end[0] + i * 0.001, end[1]), 'foot-walking')
+        elapsed = time.perf_counter() - ts
+        results['rate_limit'] = {'limit_per_sec': rate, 'requests': distinct,
+                                 'achieved_per_sec': (distinct - 1) / elapsed}
+
+    # первые failures ответов - 429 с Retry-After
+    with FakeORSServer(points=100, status=429, failures=failures, retry_after=0.1) as ors:
+        backend = routing.ORSBackend('bench', base_url=ors.url, rate=1000, burst=1000, retries=failures)
+        ts = time.perf_counter()
+        backend.directions(START, end, 'foot-walking')
+        results['backoff'] = {'failures': failures, 'http_requests': ors.requests,
+                              'recovery_ms': (time.perf_counter() - ts) * 1000}
+    return results
+
+
+CASES = {'calc_loc': bench_calc_loc,
+         'ipc': bench_ipc,
+         'move': bench_move,
+         'saver': bench_saver,
+         'ors': bench_ors}
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(cases):
+    result = {'ts': time.time(),
+              'git_rev': _git_rev(),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'results': {}}
+    for name in cases:
+        result['results'][name] = CASES[name]()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='locd benchmark suite')
+    parser.add_argument('-c', '--cases', nargs='+', choices=list(CASES), default=list(CASES),
+                        help='(Default: all)')
+    parser.add_argument('-o', '--output', help='Write JSON to file instead of stdout')
+    args = parser.parse_args()
+    result = run(args.cases)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
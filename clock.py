@@ -0,0 +1,46 @@
+import time
+import threading
+
+# Часы для трекеров: у всех метод time() -> unix time (сек).
+# WallClock - реальное время, ScaledClock - ускоренное в factor раз, ManualClock - время двигается вручную
+
+
+class WallClock:
+    def time(self):
+        return time.time()
+
+
+class ScaledClock:
+    def __init__(self, factor, start=None):
+        self.factor = factor
+        self._real_start = time.time()
+        self._start = self._real_start if start is None else start
+
+    def time(self):
+        return self._start + (time.time() - self._real_start) * self.factor
+
+
+class ManualClock:
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def advance(self, dt):
+        with self._lock:
+            self._now += dt
+            return self._now
+
+    def set(self, ts):
+        with self._lock:
+            self._now = ts
+
+
+WALL = WallClock()
+
+
+# Часы по параметрам запуска демона: factor = 1 - реальное время
+def make_clock(factor=1):
+    return WALL if factor == 1 else ScaledClock(factor)
@@ -4,3 +4,33 @@ PID_FILE = '/var/run/locd/locd.pid'
 LOG_FILE = '/var/log/locd/locd.log'
 SOCK_FILE = '/var/run/locd/locd.sock'
 REFRESH_CUR_TIME = 0.5
+ROUTE_CACHE_FILE = None
+ROUTE_CACHE_MEM_SIZE = 256
+ROUTE_CACHE_DISK_SIZE = 10000
+ROUTE_CACHE_TTL = 7 * 24 * 3600
+ROUTE_CACHE_PRECISION = 4
+SUBSCRIBE_TICK = 0.1
+CUR_SHM_FILE = None
+CUR_FILE_SAVE_TIME = 10
+LOCAL_GRAPH_FILE = None
+ROUTE_WORKERS = 4
+ROUTE_DEBOUNCE = 0.3
+ROUTE_DEDUPE_DIST = 0.5
+ROUTE_SIMPLIFY_TOLERANCE = 2.0
+ROUTE_DENSIFY_SPACING = None
+ORS_RATE = 40 / 60
+ORS_BURST = 5
+ORS_RETRIES = 4
+ORS_TIMEOUT = 20
+SIM_TIME_FACTOR = 1
+SIM_SEED = None
+LOG_REQUEST_INTERVAL = 1.0
+HISTORY_FILE = None
+HISTORY_BATCH = 64
+HISTORY_QUERY_LIMIT = 10000
+SNAPSHOT_FILE = None
+SNAPSHOT_JOURNAL_MAX = 1000
+TRACKER_NAME = 'locd'
+GEOFENCE_FILE = None
+GEOFENCE_CELL = 0.01
+GEOFENCE_EVENT_QUEUE = 1000
@@ -0,0 +1,261 @@
+import os
+import math
+import json
+import threading
+
+import geometry
+import metrics
+
+# Пространственный индекс геозон (круги и многоугольники) и текущих положений трекеров на сетке
+# lat/lon-ячеек. Зона записывается во все ячейки своего bbox, поэтому проверка точки - это одна ячейка
+# и точная проверка только зон из нее. Зоны, bbox которых больше MAX_CELLS ячеек, проверяются всегда
+
+MAX_CELLS = 1024
+_M_PER_DEG = geometry.M_PER_DEG
+_events_total = metrics.Counter('locd_geofence_events_total', 'Geofence enter/exit events')
+
+
+class Circle:
+    kind = 'circle'
+
+    def __init__(self, name, lat, lon, radius):
+        self.name = name
+        self.center = (lat, lon)
+        self.radius = radius
+        dlat = radius / _M_PER_DEG
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        self.bbox = (lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+    def contains(self, lat, lon):
+        return self.distance(lat, lon) == 0.0
+
+    # Расстояние (метры) от точки до зоны, 0 - точка внутри
+    def distance(self, lat, lon):
+        return max(math.hypot(*geometry.offset(self.center, (lat, lon))) - self.radius, 0.0)
+
+    def to_dict(self):
+        return {'name': self.name, 'circle': [self.center[0], self.center[1], self.radius]}
+
+
+class Polygon:
+    kind = 'polygon'
+
+    def __init__(self, name, points):
+        if len(points) < 3:
+            raise ValueError(f'Polygon {name} needs at least 3 points')
+        self.name = name
+        self.points = [tuple(pnt) for pnt in points]
+        lats = [pnt[0] for pnt in self.points]
+        lons = [pnt[1] for pnt in self.points]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+
+    # Луч вдоль широты: нечетное число пересечений сторон - точка внутри
+    def contains(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        inside = False
+        pts = self.points
+        j = len(pts) - 1
+        for i in range(len(pts)):
+            (lat_i, lon_i), (lat_j, lon_j) = pts[i], pts[j]
+            if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+            j = i
+        return inside
+
+    def distance(self, lat, lon):
+        if self.contains(lat, lon):
+            return 0.0
+        pnt = (lat, lon)
+        return min(geometry.segment_dist(pnt, a, b) for a, b in zip(self.points, self.points[1:] + self.points[:1]))
+
+    def to_dict(self):
+        return {'name': self.name, 'polygon': [list(pnt) for pnt in self.points]}
+
+
+# Зона из словаря {'name': ..., 'circle': [lat, lon, radius]} или {'name': ..., 'polygon': [[lat, lon], ...]}
+def fence_from_dict(item):
+    if 'circle' in item:
+        return Circle(item['name'], *item['circle'])
+    if 'polygon' in item:
+        return Polygon(item['name'], item['polygon'])
+    raise ValueError(f'Unknown fence: {item}')
+
+
+class GeoIndex:
+    # cell - размер ячейки сетки (градусы), listener(event) - вызывается для событий входа/выхода из зон
+    def __init__(self, cell=0.01, listener=None):
+        self.cell = cell
+        self.listener = listener
+        self._lock = threading.Lock()
+        self._fences = {}       # name -> зона
+        self._fence_cells = {}  # ячейка -> set имен зон
+        self._large = set()     # имена зон, не записанных в ячейки
+        self._fences_ver = 0
+        self._trackers = {}     # имя трекера -> (lat, lon, ячейка, версия зон)
+        self._tracker_cells = {}  # ячейка -> set имен трекеров
+        self._inside = {}       # имя трекера -> set имен зон, в которых он находится
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        index = cls(**kwargs)
+        with open(path, 'r') as f:
+            for item in json.load(f):
+                index.add(fence_from_dict(item))
+        return index
+
+    # Атомарно сохранить зоны в json-файл
+    def save(self, path):
+        with self._lock:
+            items = [fence.to_dict() for fence in self._fences.values()]
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(items, f)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self._fences)
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell))
+
+    def _bbox_cells(self, bbox):
+        (i0, j0), (i1, j1) = self._cell(bbox[0], bbox[1]), self._cell(bbox[2], bbox[3])
+        return i0, j0, i1, j1
+
+    # Добавить зону (зона с тем же именем заменяется)
+    def add(self, fence):
+        with self._lock:
+            self._remove(fence.name)
+            self._fences[fence.name] = fence
+            i0, j0, i1, j1 = self._bbox_cells(fence.bbox)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > MAX_CELLS:
+                self._large.add(fence.name)
+            else:
+                for i in range(i0, i1 + 1):
+                    for j in range(j0, j1 + 1):
+                        self._fence_cells.setdefault((i, j), set()).add(fence.name)
+            self._fences_ver += 1
+
+    # Удалить зону, вернуть False, если ее не было. Трекеры из нее выходят без события
+    def remove(self, name):
+        with self._lock:
+            return self._remove(name)
+
+    def _remove(self, name):
+        fence = self._fences.pop(name, None)
+        if fence is None:
+            return False
+        if name in self._large:
+            self._large.discard(name)
+        else:
+            i0, j0, i1, j1 = self._bbox_cells(fence.bbox)
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    names = self._fence_cells[(i, j)]
+                    names.discard(name)
+                    if not names:
+                        del self._fence_cells[(i, j)]
+        for inside in self._inside.values():
+            inside.discard(name)
+        self._fences_ver += 1
+        return True
+
+    def fences(self):
+        with self._lock:
+            return [fence.to_dict() for fence in self._fences.values()]
+
+    # Имена зон, содержащих точку: проверяются только зоны ячейки точки и большие зоны
+    def fences_at(self, lat, lon):
+        with self._lock:
+            return self._fences_at(lat, lon)
+
+    def _fences_at(self, lat, lon):
+        names = self._fence_cells.get(self._cell(lat, lon), ())
+        return {name for group in (names, self._large) for name in group
+                if self._fences[name].contains(lat, lon)}
+
+    # Зоны, в которых находится трекер
+    def inside(self, tracker):
+        with self._lock:
+            return sorted(self._inside.get(tracker, ()))
+
+    # Новое положение трекера: перенести его в ячейку и разослать события входа/выхода из зон
+    def update(self, tracker, lat, lon, ts=None):
+        with self._lock:
+            cell = self._cell(lat, lon)
+            prev = self._trackers.get(tracker)
+            if prev and prev[:2] == (lat, lon) and prev[3] == self._fences_ver:
+                return []
+            if prev and prev[2] != cell:
+                self._tracker_cells[prev[2]].discard(tracker)
+                if not self._tracker_cells[prev[2]]:
+                    del self._tracker_cells[prev[2]]
+            self._tracker_cells.setdefault(cell, set()).add(tracker)
+            self._trackers[tracker] = (lat, lon, cell, self._fences_ver)
+
+            inside = self._fences_at(lat, lon)
+            was_inside = self._inside.get(tracker, set())
+            self._inside[tracker] = inside
+            events = [{'event': event, 'fence': name, 'tracker': tracker, 'loc': (lat, lon), 'ts': ts}
+                      for event, names in (('exit', was_inside - inside), ('enter', inside - was_inside))
+                      for name in sorted(names)]
+        for event in events:
+            _events_total.inc(event=event['event'])
+            if self.listener:
+                self.listener(event)
+        return events
+
+    def remove_tracker(self, tracker):
+        with self._lock:
+            prev = self._trackers.pop(tracker, None)
+            if prev:
+                self._tracker_cells[prev[2]].discard(tracker)
+                if not self._tracker_cells[prev[2]]:
+                    del self._tracker_cells[prev[2]]
+            self._inside.pop(tracker, None)
+
+    # Трекеры и зоны не дальше radius метров от точки, по возрастанию расстояния
+    def nearby(self, lat, lon, radius):
+        dlat = radius / _M_PER_DEG
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        i0, j0, i1, j1 = self._bbox_cells((lat - dlat, lon - dlon, lat + dlat, lon + dlon))
+        n_cells = (i1 - i0 + 1) * (j1 - j0 + 1)
+        pnt = (lat, lon)
+        with self._lock:
+            # Если ячеек в круге больше, чем объектов, быстрее проверить все объекты
+            if n_cells > len(self._trackers):
+                trackers = set(self._trackers)
+            else:
+                trackers = set()
+                for cell in self._cells_in(i0, j0, i1, j1, self._tracker_cells):
+                    trackers |= self._tracker_cells[cell]
+            if n_cells > len(self._fences):
+                fences = set(self._fences)
+            else:
+                fences = set(self._large)
+                for cell in self._cells_in(i0, j0, i1, j1, self._fence_cells):
+                    fences |= self._fence_cells[cell]
+
+            found_trackers = []
+            for name in trackers:
+                t_lat, t_lon = self._trackers[name][:2]
+                dist = math.hypot(*geometry.offset(pnt, (t_lat, t_lon)))
+                if dist <= radius:
+                    found_trackers.append({'name': name, 'loc': (t_lat, t_lon), 'dist': dist})
+            found_fences = []
+            for name in fences:
+                dist = self._fences[name].distance(lat, lon)
+                if dist <= radius:
+                    found_fences.append({'name': name, 'kind': self._fences[name].kind, 'dist': dist})
+        found_trackers.sort(key=lambda item: item['dist'])
+        found_fences.sort(key=lambda item: item['dist'])
+        return {'trackers': found_trackers, 'fences': found_fences}
+
+    @staticmethod
+    def _cells_in(i0, j0, i1, j1, cells):
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                if (i, j) in cells:
+                    yield i, j
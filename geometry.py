@@ -0,0 +1,110 @@
+import math
+from array import array
+
+import pyproj
+
+# Предобработка геометрии маршрута (точки (lat, lon)), выполняется один раз при построении маршрута.
+# Расстояния до отрезков считаются в локальной равнопромежуточной проекции: для отрезков маршрута
+# (десятки - сотни метров) ошибка много меньше допуска
+
+_geod = pyproj.Geod(ellps='WGS84')
+M_PER_DEG = 6371008.8 * math.pi / 180
+
+
+# Смещение (x, y) в метрах точки p (lat, lon) относительно точки o
+def offset(o, p):
+    return (p[1] - o[1]) * M_PER_DEG * math.cos(math.radians(o[0])), (p[0] - o[0]) * M_PER_DEG
+
+
+# Расстояние (метры) от точки p до отрезка a-b
+def segment_dist(p, a, b):
+    px, py = offset(a, p)
+    bx, by = offset(a, b)
+    len2 = bx * bx + by * by
+    if len2 == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * bx + py * by) / len2))
+    return math.hypot(px - t * bx, py - t * by)
+
+
+# Убрать точки ближе min_dist метров к предыдущей оставленной (0 - только точные повторы).
+# Первая и последняя точки сохраняются
+def dedupe(points, min_dist=0.0):
+    if len(points) < 3:
+        return list(points)
+    result = [points[0]]
+    for pnt in points[1:]:
+        last = result[-1]
+        if pnt == last:
+            continue
+        if min_dist > 0 and math.hypot(*offset(last, pnt)) < min_dist:
+            continue
+        result.append(pnt)
+    if result[-1] != points[-1]:
+        if len(result) > 1:
+            result[-1] = points[-1]
+        else:
+            result.append(points[-1])
+    return result
+
+
+# Дуглас-Пекер: путь остается в пределах tolerance метров от исходного
+def simplify(points, tolerance):
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return list(points)
+    keep = bytearray(n)
+    keep[0] = keep[-1] = 1
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        a, b = points[first], points[last]
+        max_d, max_i = 0.0, None
+        for i in range(first + 1, last):
+            d = segment_dist(points[i], a, b)
+            if d > max_d:
+                max_d, max_i = d, i
+        if max_i is not None and max_d > tolerance:
+            keep[max_i] = 1
+            stack.append((first, max_i))
+            stack.append((max_i, last))
+    return [pnt for pnt, k in zip(points, keep) if k]
+
+
+# Добавить точки на отрезки длиннее spacing метров (исходные точки сохраняются), одним вызовом Geod.fwd
+def densify(points, spacing):
+    if len(points) < 2 or not spacing or spacing <= 0:
+        return list(points)
+    lats = array('d', (pnt[0] for pnt in points))
+    lons = array('d', (pnt[1] for pnt in points))
+    az, _, dist = _geod.inv(lons[:-1], lats[:-1], lons[1:], lats[1:])
+    src_lats, src_lons, src_az, offs = array('d'), array('d'), array('d'), array('d')
+    # Для каждой новой точки: номер отрезка, после начала которого она вставляется
+    seg_idx = []
+    for i, d in enumerate(dist):
+        parts = math.ceil(d / spacing)
+        for k in range(1, parts):
+            src_lats.append(lats[i])
+            src_lons.append(lons[i])
+            src_az.append(az[i])
+            offs.append(d * k / parts)
+            seg_idx.append(i)
+    if not seg_idx:
+        return list(points)
+    new_lons, new_lats, _ = _geod.fwd(src_lons, src_lats, src_az, offs)
+    result = []
+    j = 0
+    for i, pnt in enumerate(points):
+        result.append(pnt)
+        while j < len(seg_idx) and seg_idx[j] == i:
+            result.append((new_lats[j], new_lons[j]))
+            j += 1
+    return result
+
+
+# Весь конвейер: повторы -> упрощение -> (необязательно) равномерное сгущение
+def process(points, dedupe_dist=0.0, tolerance=0.0, spacing=None):
+    points = dedupe(points, dedupe_dist)
+    points = simplify(points, tolerance)
+    return densify(points, spacing)
+
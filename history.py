@@ -0,0 +1,168 @@
+import os
+import time
+import json
+import struct
+import threading
+from xml.sax.saxutils import escape
+
+# История перемещений трекера: файл только на дозапись, заголовок magic(4s) version(I) и далее
+# записи фиксированного размера ts lat lon speed odo (5 x double), little-endian.
+# Записи упорядочены по ts, поэтому номер записи - это и есть индекс: смещение вычисляется,
+# а поиск по времени - двоичный, без чтения всего файла
+MAGIC = b'LOCH'
+VERSION = 1
+_HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<5d')
+FIELDS = ('ts', 'lat', 'lon', 'speed', 'odo')
+
+# Сколько записей читать за один раз при выгрузке диапазона
+_CHUNK = 1024
+
+
+def _check_header(fd, path):
+    header = os.pread(fd, _HEADER.size, 0)
+    if len(header) != _HEADER.size or _HEADER.unpack(header) != (MAGIC, VERSION):
+        raise ValueError(f'{path} is not a locd history file')
+
+
+# Пишет записи пачками: append() копит их в памяти, на диск они попадают одной записью
+# при накоплении batch_size записей или по явному flush()
+class HistoryWriter:
+    def __init__(self, path, batch_size=64):
+        self.path = path
+        self.batch_size = batch_size
+        self._buf = []
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o664)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            os.write(self._fd, _HEADER.pack(MAGIC, VERSION))
+            size = _HEADER.size
+        else:
+            _check_header(self._fd, path)
+        # Недописанную при аварии последнюю запись отбрасываем
+        tail = (size - _HEADER.size) % RECORD.size
+        if tail:
+            os.truncate(path, size - tail)
+            size -= tail
+        self._last_ts = None
+        if size > _HEADER.size:
+            self._last_ts = RECORD.unpack(os.pread(self._fd, RECORD.size, size - RECORD.size))[0]
+
+    @property
+    def last_ts(self):
+        return self._last_ts
+
+    # Добавить запись, вернуть False, если ts не больше последнего (порядок по времени обязателен)
+    def append(self, ts, lat, lon, speed=0.0, odo=0.0):
+        with self._lock:
+            if self._last_ts is not None and ts <= self._last_ts:
+                return False
+            self._last_ts = ts
+            self._buf.append(RECORD.pack(ts, lat, lon, speed, odo))
+            if len(self._buf) >= self.batch_size:
+                self._flush()
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buf:
+            os.write(self._fd, b''.join(self._buf))
+            self._buf = []
+
+    def close(self):
+        self.flush()
+        os.close(self._fd)
+
+
+class HistoryReader:
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            _check_header(self._fd, path)
+        except ValueError:
+            os.close(self._fd)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        os.close(self._fd)
+
+    # Число полных записей; файл может расти, пока он открыт
+    def __len__(self):
+        return (os.fstat(self._fd).st_size - _HEADER.size) // RECORD.size
+
+    def _read(self, start, count):
+        data = os.pread(self._fd, count * RECORD.size, _HEADER.size + start * RECORD.size)
+        return list(RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]))
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('history record index out of range')
+        return self._read(i, 1)[0]
+
+    # Номер первой записи с ts >= ts (или, если right, с ts > ts)
+    def bisect(self, ts, right=False):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_ts = RECORD.unpack(os.pread(self._fd, RECORD.size, _HEADER.size + mid * RECORD.size))[0]
+            if mid_ts < ts or (right and mid_ts == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Генератор записей (ts, lat, lon, speed, odo) с start_ts <= ts <= end_ts, читает файл кусками
+    def range(self, start_ts=None, end_ts=None, limit=None):
+        first = 0 if start_ts is None else self.bisect(start_ts)
+        last = len(self) if end_ts is None else self.bisect(end_ts, right=True)
+        if limit is not None:
+            last = min(last, first + limit)
+        for pos in range(first, last, _CHUNK):
+            yield from self._read(pos, min(_CHUNK, last - pos))
+
+
+def _iso_time(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + f'.{int(ts % 1 * 1000):03d}Z'
+
+
+# Пространство имен расширений GPX (скорость и пробег точки)
+GPX_NS = 'https://github.com/AnTi3z/Locd'
+
+
+# Выгрузка в GPX: генератор строк, записи читаются по мере выдачи
+def to_gpx(records, name='locd'):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<gpx version="1.1" creator="locd" xmlns="http://www.topografix.com/GPX/1/1" xmlns:locd="{GPX_NS}">\n'
+           f'<trk><name>{escape(name)}</name><trkseg>\n')
+    for ts, lat, lon, speed, odo in records:
+        yield (f'<trkpt lat="{lat}" lon="{lon}"><time>{_iso_time(ts)}</time>'
+               f'<extensions><locd:speed>{speed}</locd:speed><locd:odo>{odo}</locd:odo></extensions></trkpt>\n')
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+# Выгрузка в GeoJSON: FeatureCollection из точек (координаты lon, lat), чтобы писать по одной записи
+def to_geojson(records, name='locd'):
+    yield '{"type":"FeatureCollection","name":%s,"features":[\n' % json.dumps(name)
+    sep = ''
+    for ts, lat, lon, speed, odo in records:
+        yield (f'{sep}{{"type":"Feature","geometry":{{"type":"Point","coordinates":[{lon},{lat}]}},'
+               f'"properties":{{"ts":{ts},"time":"{_iso_time(ts)}","speed":{speed},"odo":{odo}}}}}')
+        sep = ',\n'
+    yield '\n]}\n'
+
+
+EXPORTS = {'gpx': to_gpx, 'geojson': to_geojson}
@@ -1,8 +1,12 @@
-import os
-import socketserver
 import socket
 import struct
 import json
+from collections.abc import Sequence
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 class IPCError(Exception):
@@ -13,30 +17,91 @@ class ConnectionClosed(IPCError):
     pass
 
 
-def _read_objects(sock):
-    header = sock.recv(4)
-    if len(header) == 0:
-        raise ConnectionClosed()
+# Последовательности-представления (например, location.TrackView) кодируем как списки
+def _encode_default(obj):
+    if isinstance(obj, Sequence):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not serializable')
+
+
+def _json_dumps(objects):
+    return json.dumps(objects, default=_encode_default, separators=(',', ':')).encode('utf-8')
+
+
+# Кодировки тела кадра: имя -> (dumps, loads). Согласуются отдельно для каждого соединения
+CODECS = {'json': (_json_dumps, json.loads)}
+if msgpack:
+    CODECS['msgpack'] = (lambda objects: msgpack.packb(objects, default=_encode_default),
+                         lambda data: msgpack.unpackb(data, raw=False))
+
+# Первый кадр клиента {'ipc_hello': [кодировки по предпочтению]} обрабатывается самим сервером,
+# ответ {'ipc_encoding': выбранная} отправляется в json, дальше соединение работает в выбранной кодировке
+HELLO_KEY = 'ipc_hello'
+ENCODING_KEY = 'ipc_encoding'
+# Кадр ошибки сервера: {'error': описание} (и req_id запроса, если он был), клиент поднимает IPCError
+ERROR_KEY = 'error'
+# Максимальный размер кадра (байт, вместе с заголовком)
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            raise ConnectionClosed()
+        pos += n
+    return buf
+
+
+# Длина кадра из заголовка. После неверной длины границы кадров потеряны - соединение только закрыть
+def _frame_size(header):
     size = struct.unpack('!i', header)[0]
-    data = sock.recv(size - 4)
-    if len(data) == 0:
-        raise ConnectionClosed()
-    return json.loads(data)
+    if not 4 <= size <= MAX_FRAME:
+        raise ConnectionClosed(f'Bad frame size: {size}')
+    return size
 
 
-def _write_objects(sock, objects):
-    data = json.dumps(objects)
-    sock.sendall(struct.pack('!i', len(data) + 4))
-    sock.sendall(data.encode('utf-8'))
+def _read_objects(sock, encoding='json'):
+    size = _frame_size(_recv_exactly(sock, 4))
+    data = _recv_exactly(sock, size - 4)
+    return CODECS[encoding][1](data)
+
+
+# Кадр: 4 байта длины (вместе с заголовком) + тело в заданной кодировке
+def _pack_objects(objects, encoding='json'):
+    data = CODECS[encoding][0](objects)
+    return struct.pack('!i', len(data) + 4) + data
+
+
+def _write_objects(sock, objects, encoding='json'):
+    sock.sendall(_pack_objects(objects, encoding))
+
+
+# Выбрать первую поддерживаемую обеими сторонами кодировку
+def _choose_encoding(offered):
+    for encoding in offered:
+        if encoding in CODECS:
+            return encoding
+    return 'json'
 
 
 class Client:
-    def __init__(self, server_address):
+    def __init__(self, server_address, encoding='json'):
         self.addr = server_address
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Желаемая кодировка, после connect() - согласованная с сервером
+        self.encoding = encoding
 
     def connect(self):
         self.sock.connect(self.addr)
+        if self.encoding not in CODECS:
+            self.encoding = 'json'
+        if self.encoding != 'json':
+            _write_objects(self.sock, {HELLO_KEY: [self.encoding, 'json']})
+            self.encoding = _read_objects(self.sock)[ENCODING_KEY]
 
     def close(self):
         self.sock.close()
@@ -49,32 +114,19 @@ class Client:
         self.close()
 
     def send(self, objects):
-        _write_objects(self.sock, objects)
-        return _read_objects(self.sock)
-
-
-class Server(socketserver.UnixStreamServer):
-    def __init__(self, server_address, callback, bind_and_activate=True):
-        self.addr = server_address
-
-        if not callable(callback):
-            callback = lambda x: []
-
-        class IPCHandler(socketserver.BaseRequestHandler):
-            def handle(self):
-                while True:
-                    try:
-                        results = _read_objects(self.request)
-                    except ConnectionClosed as e:
-                        return
-                    _write_objects(self.request, callback(results))
-
-        socketserver.TCPServer.__init__(self, server_address, IPCHandler, bind_and_activate)
-
-    def server_close(self):
-        super().server_close()
-        try:
-            os.unlink(self.addr)
-        except OSError:
-            if os.path.exists(self.addr):
-                raise
+        self.write(objects)
+        return self.reply()
+
+    def write(self, objects):
+        _write_objects(self.sock, objects, self.encoding)
+
+    # Ответ на отправленный запрос, кадр ошибки сервера поднимается как IPCError
+    def reply(self):
+        response = self.recv()
+        if isinstance(response, dict) and response.keys() == {ERROR_KEY}:
+            raise IPCError(response[ERROR_KEY])
+        return response
+
+    # Следующий кадр от сервера (например, кадр подписки)
+    def recv(self):
+        return _read_objects(self.sock, self.encoding)
@@ -1,24 +1,47 @@
 import time
 import random
+import itertools
+import threading
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
 
 import pyproj
-import openrouteservice
 from openrouteservice import convert
 
-from config import API_KEY
+import routing
+import metrics
+import geometry
+import clock as clocks
+from config import API_KEY, ORS_RATE, ORS_BURST, ORS_RETRIES, ORS_TIMEOUT, ROUTE_WORKERS
+
+
+# Общие для всех точек объекты pyproj: их создание намного дороже самих вычислений
+_geod = pyproj.Geod(ellps='WGS84')
+_transformers = {}
+
+
+# Пара трансформеров (WGS84 -> proj_name, proj_name -> WGS84), создается один раз на проекцию
+def _get_transformers(proj_name):
+    trans = _transformers.get(proj_name)
+    if trans is None:
+        trans = (pyproj.Transformer.from_crs('epsg:4326', proj_name, always_xy=True),
+                 pyproj.Transformer.from_crs(proj_name, 'epsg:4326', always_xy=True))
+        _transformers[proj_name] = trans
+    return trans
 
 
 class Location:
+    __slots__ = ('_lat', '_lon', '_proj_name', '_xy')
+
     def __init__(self, lat=0.0, lon=0.0, proj_name='epsg:3857'):
         #  epsg:3857 Pseudo-mercator
         #  epsg:3395 Mercator projection
-        self._lat = None
-        self._lon = None
-        self._proj = None
-        self._geod = pyproj.Geod(ellps='WGS84')
-        self.set_lat(lat)
-        self.set_lon(lon)
-        self.set_proj(proj_name)
+        self._lat = min(89.5, max(lat, -89.5))
+        self._lon = min(180.0, max(lon, -180.0))
+        self._proj_name = proj_name
+        # Кэш координат (x, y) в проекции, сбрасывается при изменении lat/lon
+        self._xy = None
 
     # Сравнение двух объектов экземпляра класса на соответстие координат друг другу
     def __eq__(self, other):
@@ -32,28 +55,32 @@ class Location:
 
     # Кооринаты точки на расстоянии dst и по направлению az
     def fwd(self, az, dst):
-        lon, lat, _ = self._geod.fwd(self._lon, self._lat, az, dst)
-        return Location(lat, lon)
+        lon, lat, _ = _geod.fwd(self._lon, self._lat, az, dst)
+        return Location(lat, lon, self._proj_name)
 
     # Азимут и расстояние до точки с координатами lat, lon
     def inv(self, lat, lon):
-        az, _, dst = self._geod.inv(self._lon, self._lat, lon, lat)
+        az, _, dst = _geod.inv(self._lon, self._lat, lon, lat)
         return az, dst
 
     def set_proj(self, proj_name):
-        self._proj = pyproj.Proj(init=proj_name)
+        _get_transformers(proj_name)
+        self._proj_name = proj_name
+        self._xy = None
 
     def get_lat(self):
         return self._lat
 
     def set_lat(self, new_lat):
         self._lat = min(89.5, max(new_lat, -89.5))
+        self._xy = None
 
     def get_lon(self):
         return self._lon
 
     def set_lon(self, new_lon):
         self._lon = min(180.0, max(new_lon, -180.0))
+        self._xy = None
 
     def get_pos(self):
         return self._lat, self._lon
@@ -66,19 +93,23 @@ class Location:
         return self.get_pos_xy()[0]
 
     def set_x(self, new_x):
-        self._lon, _ = self._proj(new_x, self.get_y(), inverse=True)
+        self.set_pos_xy(new_x, self.get_pos_xy()[1])
 
     def get_y(self):
         return self.get_pos_xy()[1]
 
     def set_y(self, new_y):
-        _, self._lat = self._proj(self.get_x(), new_y, inverse=True)
+        self.set_pos_xy(self.get_pos_xy()[0], new_y)
 
     def get_pos_xy(self):
-        return self._proj(self._lon, self._lat)
+        if self._xy is None:
+            self._xy = _get_transformers(self._proj_name)[0].transform(self._lon, self._lat)
+        return self._xy
 
     def set_pos_xy(self, *new_pos_xy):
-        self._lon, self._lat = self._proj(new_pos_xy[0], new_pos_xy[1], inverse=True)
+        self._lon, self._lat = _get_transformers(self._proj_name)[1].transform(new_pos_xy[0], new_pos_xy[1])
+        # Заданные (x, y) запоминаем, чтобы следующий set_x/set_y не делал прямую проекцию
+        self._xy = (new_pos_xy[0], new_pos_xy[1])
 
     # Получение/установка широты(lat) и долготы(lon) точки
     lat = property(get_lat, set_lat)
@@ -92,33 +123,170 @@ class Location:
     pos_xy = property(get_pos_xy, set_pos_xy)
 
 
-class Tracker:
-    ors_client = openrouteservice.Client(key=API_KEY)
+routing.register('ors', routing.ORSBackend(API_KEY, rate=ORS_RATE, burst=ORS_BURST, pool_size=ROUTE_WORKERS,
+                                           retries=ORS_RETRIES, timeout=ORS_TIMEOUT))
+
+_route_backend_seconds = metrics.Histogram('locd_route_backend_seconds', 'Route requests to routing backends')
+_route_backend_errors = metrics.Counter('locd_route_backend_errors_total', 'Failed route requests')
+_route_cache_requests = metrics.Counter('locd_route_cache_requests_total', 'Route cache lookups by result')
+_calc_loc_total = metrics.Counter('locd_calc_loc_total', 'Tracker position calculations')
+_waypoints_passed = metrics.Counter('locd_waypoints_passed_total', 'Track waypoints passed by trackers')
+_tracker_ids = itertools.count(1)
+_route_points = metrics.Histogram('locd_route_points', 'Route geometry points by preprocessing stage',
+                                  buckets=(10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000))
+_route_geometry_bytes = metrics.Histogram('locd_route_geometry_bytes', 'Encoded route geometry size by stage',
+                                          buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+
+# Представление оставшейся части трека без копирования списка точек
+class TrackView(Sequence):
+    __slots__ = ('_track', '_start')
+
+    def __init__(self, track, start=0):
+        self._track = track
+        self._start = start
+
+    def __len__(self):
+        return max(len(self._track) - self._start, 0)
 
-    def __init__(self, lat=0.0, lon=0.0):
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self._track[self._start:][idx]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('track index out of range')
+        return self._track[self._start + idx]
+
+    def __iter__(self):
+        for idx in range(self._start, len(self._track)):
+            yield self._track[idx]
+
+    def __repr__(self):
+        return f'TrackView({list(self)!r})'
+
+
+class Tracker:
+    # Кэш маршрутов (routecache.RouteCache), задается демоном
+    route_cache = None
+    # Пул потоков для построения маршрутов (concurrent.futures.Executor), задается демоном.
+    # Если не задан, маршрут строится синхронно
+    planner = None
+    # Если move приходит, пока строится маршрут предыдущего (например, точку тянут по карте), новый маршрут
+    # строится с задержкой debounce сек и только если за это время его не сменил следующий move
+    debounce = 0.0
+    # Предобработка геометрии от бэкенда (см. geometry.process): точки ближе dedupe_dist м к предыдущей убираются,
+    # путь упрощается с допуском simplify_tolerance м, densify_spacing - макс. расстояние между точками (None - как есть)
+    dedupe_dist = 0.0
+    simplify_tolerance = 0.0
+    densify_spacing = None
+    # Индекс геозон и положений трекеров (geofence.GeoIndex), задается демоном. Обновляется в _calc_loc
+    geofences = None
+
+    # prof - профиль маршрута, он же выбирает бэкенд (см. routing.get_backend)
+    # clock - часы (см. clock.py), rng - генератор случайных чисел для noised_loc (например, random.Random(seed)),
+    # name - имя трекера в индексе геозон и событиях
+    def __init__(self, lat=0.0, lon=0.0, prof='foot-walking', clock=None, rng=None, name=None):
+        self.name = name or f'tracker{next(_tracker_ids)}'
+        self._prof = prof
+        self._clock = clock or clocks.WALL
+        self._rng = rng or random
         self._rnd_noise = 1  # +/-1m
         self._cur_loc = Location(lat, lon)
-        self._sync_time = time.time()
+        self._sync_time = self._clock.time()
         self._speed = 0
         self._target_loc = self._cur_loc
         self._track = None  # [[lat1, lon1], [lat2, lon2], ... etc
         self._odo = 0
-
-    def get_status(self):
+        # Номер маршрута: меняется при каждой смене трека (для снапшотов состояния)
+        self._route_ver = 0
+        self._reset_route()
+        # Асинхронное построение маршрута: номер последнего запроса, future и готовый результат
+        self._planning = False
+        self._plan_gen = 0
+        self._plan_future = None
+        self._pending_route = None
+        self._pending_lock = threading.Lock()
+        # Маршрут через несколько точек: текущий участок ведет в _target_loc, дальше - _waypoints.
+        # Следующий участок строится заранее, пока идем по текущему (_leg_future)
+        self._waypoints = []
+        self._leg_idx = 0
+        self._legs_total = 0
+        self._leg_future = None
+
+    # Трек (может быть длинным) добавляется, только если track=True или если версия трека клиента track_ver
+    # устарела. Пока версия та же, трек только укорачивается: track_offset - номер первой оставшейся точки
+    def get_status(self, track=False, track_ver=None):
+        self._calc_loc()
+        status = {'cur_loc': self._cur_loc.pos,
+                  'target_loc': self._target_loc.pos,
+                  'speed': self._speed,
+                  'azimuth': self._azimuth(),
+                  'odo': self._odo,
+                  'state': self.get_state(),
+                  'leg': self._leg_idx,
+                  'legs_left': len(self._waypoints),
+                  'track_ver': self._route_ver,
+                  'track_offset': self._track_idx}
+        if Tracker.geofences is not None:
+            status['fences'] = Tracker.geofences.inside(self.name)
+        if track or (track_ver is not None and track_ver != self._route_ver):
+            status['track'] = self.get_track()
+        return status
+
+    # Краткое состояние без трека (для потоковой рассылки подписчикам)
+    def get_position(self):
         self._calc_loc()
-        if self._track:
-            az, _ = self._cur_loc.inv(*self._track[0])
-        else:
-            az = None
         return {'cur_loc': self._cur_loc.pos,
-                'target_loc': self._target_loc.pos,
-                'track': self._track,
+                'state': self.get_state(),
                 'speed': self._speed,
-                'azimuth': az,
-                'odo': self._odo}
-
+                'azimuth': self._azimuth(),
+                'odo': self._odo,
+                'ts': self._sync_time}
+
+    # Азимут на следующую точку трека
+    def _azimuth(self):
+        if not self._track:
+            return None
+        az, _ = self._cur_loc.inv(*self._track[self._track_idx])
+        return az
+
+    # Оставшаяся часть трека (TrackView) или None
     def get_track(self):
-        return self._track
+        if self._track is None:
+            return None
+        return TrackView(self._track, self._track_idx)
+
+    # Страница трека: не больше limit точек, начиная с номера offset в полном треке (по умолчанию - с текущей).
+    # next - offset следующей страницы. encoded=True - точки в виде encoded polyline вместо списка
+    def get_track_page(self, offset=None, limit=None, encoded=False):
+        page = {'track_ver': self._route_ver}
+        if self._track is None:
+            page.update(track_offset=None, total=0, next=None)
+            page['polyline' if encoded else 'track'] = None
+            return page
+        # Пройденные точки уже не отдаем
+        start = self._track_idx if offset is None else max(offset, self._track_idx)
+        end = len(self._track) if limit is None else min(start + max(limit, 0), len(self._track))
+        points = self._track[start:end]
+        page.update(track_offset=start,
+                    total=len(self._track) - self._track_idx,
+                    next=end if end < len(self._track) else None)
+        if encoded:
+            page['polyline'] = routing.encode_polyline([(lon, lat) for lat, lon in points])
+        else:
+            page['track'] = points
+        return page
+
+    # 'planning' - строится маршрут, 'moving' - движемся по треку, 'idle' - стоим
+    def get_state(self):
+        if self._planning:
+            return 'planning'
+        return 'moving' if self._track else 'idle'
+
+    # Движемся или собираемся двигаться (строится маршрут)
+    def is_moving(self):
+        return self._planning or bool(self._track)
 
     def get_speed(self):
         return self._speed
@@ -134,7 +302,12 @@ class Tracker:
     def set_pos(self, new_lat, new_lon):
         self._speed = 0
         self._cur_loc = Location(new_lat, new_lon)
-        self._sync_time = time.time()
+        # Старый трек строился от другой точки
+        self._cancel_planning()
+        self._clear_legs()
+        self._track = None
+        self._reset_route()
+        self._sync_time = self._clock.time()
 
     # Получить точные координаты текущей точки (Location)
     def accurate_loc(self):
@@ -145,8 +318,8 @@ class Tracker:
     def noised_loc(self):
         self._calc_loc()
         fake_loc = Location(*self._cur_loc.pos)
-        fake_loc.x = random.gauss(fake_loc.x, self._rnd_noise / 2)
-        fake_loc.y = random.gauss(fake_loc.y, self._rnd_noise / 2)
+        fake_loc.x = self._rng.gauss(fake_loc.x, self._rnd_noise / 2)
+        fake_loc.y = self._rng.gauss(fake_loc.y, self._rnd_noise / 2)
         return fake_loc
 
     # Координаты последней полученной точки (Location)
@@ -155,90 +328,405 @@ class Tracker:
 
     # Время (в сек) с момента последнего расчета координат
     def elapsed_time(self):
-        return time.time() - self._sync_time
+        return self._clock.time() - self._sync_time
 
-    # Построить трек от cur_pos до target_pos
-    def _build_route(self, prof='foot-walking'):
+    # Полное состояние трекера для снапшота (см. snapshot.py). Трек не копируется: он только заменяется целиком
+    def dump_state(self):
+        return {'cur_loc': self._cur_loc.pos,
+                'route_start': self._route_start,
+                'target_loc': self._target_loc.pos,
+                'track': self._track,
+                'waypoints': list(self._waypoints),
+                'speed': self._speed,
+                'odo': self._odo,
+                'sync_time': self._sync_time,
+                'prof': self._prof,
+                'leg': self._leg_idx,
+                'legs_total': self._legs_total,
+                'route_ver': self._route_ver}
+
+    # Восстановить состояние из dump_state() без построения маршрута: движение продолжается с того же места
+    def load_state(self, state):
+        self._cancel_planning()
+        self._clear_legs(state['legs_total'])
+        self._prof = state['prof']
+        self._cur_loc = Location(*state['cur_loc'])
+        self._target_loc = Location(*state['target_loc'])
+        self._track = state['track']
+        self._index_route(tuple(state['route_start']))
+        self._waypoints = [tuple(pnt) for pnt in state['waypoints']]
+        self._leg_idx = state['leg']
+        self._speed = state['speed']
+        self._odo = state['odo']
+        # В снапшоте положение на момент смены маршрута, текущее - по пройденному пути из журнала
+        if self._track and self._odo < self._cum_dist[-1]:
+            self._place_on_route()
+        # Пока демон не работал, трекер стоял: движение продолжается с сохраненной точки
+        self._sync_time = self._clock.time()
+        self._prefetch_leg()
+
+    # Сбросить предрассчитанную геометрию маршрута
+    def _reset_route(self):
+        self._route_ver += 1
+        self._route_start = self._cur_loc.pos
+        self._track_idx = 0
+        self._seg_az = array('d')
+        self._cum_dist = array('d', [0.0])
+
+    # Предрассчитать азимуты сегментов и накопленные расстояния вдоль трека (от start, по умолчанию - текущей точки)
+    def _index_route(self, start=None):
+        self._reset_route()
+        if start:
+            self._route_start = start
+        if not self._track:
+            return
+        lats = array('d', [self._route_start[0]])
+        lons = array('d', [self._route_start[1]])
+        for lat, lon in self._track:
+            lats.append(lat)
+            lons.append(lon)
+        # Одним вызовом считаем все сегменты: (start -> track[0]), (track[0] -> track[1]), ...
+        az, _, dist = _geod.inv(lons[:-1], lats[:-1], lons[1:], lats[1:])
+        self._seg_az = array('d', az)
+        cum = 0.0
+        for d in dist:
+            cum += d
+            self._cum_dist.append(cum)
+
+    # Поставить трекер на трек по пройденному пути _odo (меньше длины трека), вернуть номер сегмента
+    def _place_on_route(self):
+        # Бинарным поиском находим сегмент, на котором мы сейчас находимся
+        idx = bisect_right(self._cum_dist, self._odo) - 1
+        self._track_idx = idx
+        origin = Location(*self._segment_origin(idx))
+        # Двигаемся от начала сегмента на оставшееся расстояние вдоль его азимута
+        self._cur_loc = origin.fwd(self._seg_az[idx], self._odo - self._cum_dist[idx])
+        return idx
+
+    # Начальная точка сегмента idx (сегмент idx заканчивается в точке track[idx])
+    def _segment_origin(self, idx):
+        return self._track[idx - 1] if idx else self._route_start
+
+    # Геометрия маршрута (encoded polyline) от start до end (lat, lon): из кэша или от бэкенда профиля
+    @staticmethod
+    def _directions(start, end, prof):
+        backend, backend_prof = routing.get_backend(prof)
+        cache = Tracker.route_cache
+        if cache:
+            key = cache.key(start, end, prof, Tracker._preprocess_variant())
+            geom = cache.get(key)
+            _route_cache_requests.inc(result='miss' if geom is None else 'hit')
+            if geom is not None:
+                return geom
+        backend_name = prof.partition(':')[0] if ':' in prof else 'ors'
+        try:
+            with _route_backend_seconds.time(backend=backend_name):
+                geom = backend.directions(start, end, backend_prof)
+        except Exception:
+            _route_backend_errors.inc(backend=backend_name)
+            raise
+        geom = Tracker._preprocess(geom)
+        if cache:
+            cache.put(key, geom)
+        return geom
+
+    # Параметры _preprocess для ключа кэша: после их смены кэш не отдает геометрию, обработанную по-старому
+    @staticmethod
+    def _preprocess_variant():
+        return f'd{Tracker.dedupe_dist}s{Tracker.simplify_tolerance}g{Tracker.densify_spacing}'
+
+    # Геометрия после geometry.process, обрабатывается один раз до записи в кэш
+    @staticmethod
+    def _preprocess(geom):
+        coords = convert.decode_polyline(geom)['coordinates']
+        points = geometry.process([(pnt[1], pnt[0]) for pnt in coords],
+                                  dedupe_dist=Tracker.dedupe_dist,
+                                  tolerance=Tracker.simplify_tolerance,
+                                  spacing=Tracker.densify_spacing)
+        processed = routing.encode_polyline([(lon, lat) for lat, lon in points])
+        _route_points.observe(len(coords), stage='raw')
+        _route_points.observe(len(points), stage='processed')
+        _route_geometry_bytes.observe(len(geom), stage='raw')
+        _route_geometry_bytes.observe(len(processed), stage='processed')
+        return processed
+
+    # Трек [(lat, lon), ...] от start до end. Состояние трекера не меняет, поэтому выполняется в потоке планировщика
+    @staticmethod
+    def _plan_route(start, end, prof):
+        geom = Tracker._directions(start, end, prof)
+        track = convert.decode_polyline(geom)['coordinates']
+        # Меняем (lon, lat) координаты на (lat, lon)
+        track = [(pnt[1], pnt[0]) for pnt in track]
+        # Последняя точка в маршруте должна быть наша цель
+        track.append(tuple(end))
+        return track
+
+    # Установить построенный трек (None - маршрут не построен, никуда не двигаемся)
+    def _set_route(self, track):
+        self._planning = False
+        self._odo = 0
+        self._track = track or []
+        self._index_route()
+        if not self._track:
+            self._speed = 0
+            # Участок не построился - остальные точки маршрута тоже отменяем
+            self._clear_legs(self._legs_total)
+
+    # Отменить (или пометить устаревшим) строящийся маршрут
+    def _cancel_planning(self):
+        self._plan_gen += 1
+        self._planning = False
+        if self._plan_future:
+            self._plan_future.cancel()
+            self._plan_future = None
+
+    # Построить трек от cur_pos до target_pos: в пуле Tracker.planner, если он задан, иначе сразу
+    def _build_route(self, prof=None):
+        superseding = self._planning
+        self._cancel_planning()
         self._odo = 0
         self._track = []
-        # TODO: Add transport type selecting "driving-car" "cycling-regular" "foot-walking"
-        if self._target_loc != self._cur_loc:
+        self._reset_route()
+        prof = prof or self._prof
+        if self._target_loc == self._cur_loc:
+            return
+        start, end = self._cur_loc.pos, self._target_loc.pos
+        if Tracker.planner is None:
+            try:
+                track = Tracker._plan_route(start, end, prof)
+            except Exception as e:
+                print(e)
+                track = None
+            self._set_route(track)
+            return
+        # До готовности маршрута стоим на месте, готовый трек подхватит _calc_loc
+        self._planning = True
+        gen = self._plan_gen
+        delay = Tracker.debounce if superseding else 0.0
+        self._plan_future = Tracker.planner.submit(self._plan_latest, gen, delay, start, end, prof)
+        self._plan_future.add_done_callback(lambda fut: self._route_planned(gen, fut))
+
+    # Вызывается в потоке планировщика: после паузы delay маршрут строится, только если запрос gen не сменился новым
+    def _plan_latest(self, gen, delay, start, end, prof):
+        if delay:
+            time.sleep(delay)
+        if gen != self._plan_gen:
+            return None
+        return Tracker._plan_route(start, end, prof)
+
+    # Вызывается в потоке планировщика
+    def _route_planned(self, gen, fut):
+        if fut.cancelled():
+            return
+        try:
+            track = fut.result()
+        except Exception as e:
+            print(e)
+            track = None
+        with self._pending_lock:
+            # Результат устаревшего запроса не должен затереть еще не подхваченный результат нового
+            if gen != self._plan_gen or (self._pending_route and self._pending_route[0] > gen):
+                return
+            self._pending_route = (gen, track, self._clock.time())
+
+    # Подхватить готовый маршрут, если он относится к последнему запросу
+    def _apply_planned(self):
+        with self._pending_lock:
+            pending, self._pending_route = self._pending_route, None
+        if pending and pending[0] == self._plan_gen:
+            gen, track, ready_ts = pending
+            self._plan_future = None
+            self._set_route(track)
+            # Движение по новому треку начинается с момента его готовности
+            self._sync_time = max(self._sync_time, ready_ts)
+
+    # Сбросить оставшиеся участки маршрута через несколько точек
+    def _clear_legs(self, legs_total=0):
+        self._waypoints = []
+        self._leg_idx = 0
+        self._legs_total = legs_total
+        if self._leg_future:
+            self._leg_future.cancel()
+            self._leg_future = None
+
+    # Заранее построить в пуле планировщика участок от текущей цели до следующей точки маршрута
+    def _prefetch_leg(self):
+        self._leg_future = None
+        if self._waypoints and Tracker.planner is not None:
+            self._leg_future = Tracker.planner.submit(Tracker._plan_route, self._target_loc.pos,
+                                                      self._waypoints[0], self._prof)
+
+    # Перейти к следующему участку маршрута (трекер в точке _target_loc), вернуть False, если участков больше нет
+    def _next_leg(self):
+        if not self._waypoints:
+            return False
+        self._cancel_planning()
+        self._leg_idx += 1
+        self._target_loc = Location(*self._waypoints.pop(0))
+        fut, self._leg_future = self._leg_future, None
+        if fut is None or fut.done():
             try:
-                geom = Tracker.ors_client.directions(coordinates=((self._cur_loc.lon, self._cur_loc.lat),
-                                                     (self._target_loc.lon, self._target_loc.lat)),
-                                                     profile=prof)['routes'][0]['geometry']
-                track = convert.decode_polyline(geom)['coordinates']
-                # Меняем (lon, lat) координаты на (lat, lon)
-                self._track = [(pnt[1], pnt[0]) for pnt in track]
-                # Последняя точка в маршруте должна быть наша цель
-                self._track.append(self._target_loc.pos)
+                track = fut.result() if fut else Tracker._plan_route(self._cur_loc.pos, self._target_loc.pos,
+                                                                     self._prof)
             except Exception as e:
                 print(e)
-                # Маршрут не построен, никуда не двигаемся
-                # self._target_loc = Location(*self._cur_loc.pos)
+                track = None
+            self._set_route(track)
+        else:
+            # Участок еще строится: ждем в точке, готовый трек подхватит _calc_loc
+            self._track = []
+            self._planning = True
+            gen = self._plan_gen
+            self._plan_future = fut
+            fut.add_done_callback(lambda f: self._route_planned(gen, f))
+        self._prefetch_leg()
+        return True
 
     # Задаем двигаться в направлении direction(азимут) на расстояние dist(метры) со скоростью speed(км/ч)
-    def move_dir(self, direction, dist, speed=3):
+    def move_dir(self, direction, dist, speed=3, prof=None):
         # Фиксируем нашу текущую позицию
         self._calc_loc()
+        if prof:
+            self._prof = prof
         self._target_loc = self._cur_loc.fwd(direction, dist)
+        self._clear_legs(1)
+        self._speed = speed
         # Строим трек до заданной точки
         self._build_route()
-        self._speed = speed
 
     # Задаем двигаться до точки с координатами lat, lon (широта, долгота) со скоростью speed(км/ч)
-    def move_to(self, lat=None, lon=None, speed=3, location=None):
+    def move_to(self, lat=None, lon=None, speed=3, location=None, prof=None):
         # Фиксируем нашу текущую позицию
         self._calc_loc()
+        if prof:
+            self._prof = prof
 
         if location:
             self._target_loc = location
         elif lat and lon:
             self._target_loc = Location(lat, lon)
+        self._clear_legs(1)
+        self._speed = speed
         # Строим трек до заданной точки
         self._build_route()
+
+    # Задаем двигаться по точкам waypoints [(lat, lon), ...] по порядку со скоростью speed(км/ч).
+    # Каждый участок строится отдельно (и кэшируется), следующий - в фоне, пока идем по текущему
+    def route_to(self, waypoints, speed=3, prof=None):
+        self._calc_loc()
+        if prof:
+            self._prof = prof
+        # Повторяющиеся подряд точки (и совпадающие с текущей) участков не дают
+        points = []
+        last = self._cur_loc.pos
+        for pnt in waypoints:
+            pnt = Location(*pnt).pos
+            if pnt != last:
+                points.append(pnt)
+                last = pnt
+        if not points:
+            points = [self._cur_loc.pos]
+        self._target_loc = Location(*points[0])
+        self._clear_legs(len(points))
+        self._waypoints = points[1:]
         self._speed = speed
+        self._build_route()
+        self._prefetch_leg()
+
+    # Прогноз положения на моменты times (unix time), через after секунд или после dists метров пути
+    # и время прибытия (eta) в целевую точку. Все точки считаются одним вызовом Geod.fwd.
+    # Прогноз только вперед: прошедшие моменты и отрицательные after и dists - ValueError.
+    # Состояние трекера (_sync_time, _odo, _cur_loc) не меняется
+    def predict(self, times=(), after=(), dists=()):
+        now = self._clock.time()
+        if any(ts < now for ts in times) or any(dt < 0 for dt in after) or any(dst < 0 for dst in dists):
+            raise ValueError('Only future positions can be predicted')
+        moving = self._speed > 0 and bool(self._track)
+        v = self._speed / 3.6 if moving else 0.0  # м/с
+        odo_now = self._odo + v * max(now - self._sync_time, 0.0)
+        total = self._cum_dist[-1] if moving else odo_now
+        remaining = max(total - odo_now, 0.0)
+
+        # Для каждого запроса: (момент времени, одометр в этот момент)
+        queries = [(ts, odo_now + v * (ts - now)) for ts in times]
+        queries += [(now + dt, odo_now + v * dt) for dt in after]
+        queries += [(now + dst / v if v else None, odo_now + dst) for dst in dists]
+
+        lats, lons, azs, offs = [], [], [], []
+        for _, odo in queries:
+            if not moving:
+                pnt, az, off = self._cur_loc.pos, 0.0, 0.0
+            elif odo >= total:
+                pnt, az, off = self._target_loc.pos, 0.0, 0.0
+            else:
+                idx = max(bisect_right(self._cum_dist, odo) - 1, 0)
+                pnt, az, off = self._segment_origin(idx), self._seg_az[idx], odo - self._cum_dist[idx]
+            lats.append(pnt[0])
+            lons.append(pnt[1])
+            azs.append(az)
+            offs.append(off)
+        if queries:
+            lons, lats, _ = _geod.fwd(lons, lats, azs, offs)
+
+        return {'ts': now,
+                'eta': now + remaining / v if moving else None,
+                'remaining': remaining,
+                'predictions': [{'ts': ts, 'odo': min(odo, total), 'loc': (lat, lon)}
+                                for (ts, odo), lat, lon in zip(queries, lats, lons)]}
 
     # Вычисление текущего положения, с учетом прошедшего времени, заданной скорости и целевой точки
     def _calc_loc(self):
+        self._apply_planned()
         # Если мы в целевой точке, то прекратить движение
         if self._cur_loc == self._target_loc:
             self._speed = 0
-        # Если маршрут не построен, пробуем построить, иначе никуда не двигаемся
-        if self._speed > 0 and not self._track:
+        # Если маршрут не построен и не строится, запускаем построение, иначе никуда не двигаемся
+        if self._speed > 0 and not self._track and not self._planning:
             self._build_route()
-            if not self._track:
-                self._speed = 0
         # Текущее время
-        ts = time.time()
-        if self._speed > 0:
+        ts = self._clock.time()
+        _calc_loc_total.inc()
+        while self._speed > 0 and self._track:
             # Прошедшее время (сек)
             delta_t = ts - self._sync_time  # delta t in seconds
             # Считаем путь, который мы должны пройти за прошедшее время (метры)
             delta_s = (self._speed / 3.6) * delta_t  # meters
             self._odo += delta_s
-            # Перебираем точки в треке, пока "пройденный" нами путь больше расстояния до следующей точки
-            while self._track:
-                # Координаты следующей точки в треке
-                next_pnt = Location(*self._track[0])
-                # Азимут и расстояние до следующей точки
-                azimuth, dist = self._cur_loc.inv(*next_pnt.pos)
-                # Если до следющей точки дальше чем пройденный нами путь, то считаем где мы остановились
-                if delta_s <= dist:
-                    # Двигаемся на расстояние delta_s в направлении следующей точки
-                    self._cur_loc = self._cur_loc.fwd(azimuth, delta_s)
-                    break
-                # Проверить, не "проскочили" ли мы финишную точку
-                elif next_pnt == self._target_loc:
-                    self._cur_loc = self._target_loc
+            self._sync_time = ts
+            # Если пройденный путь не меньше длины маршрута, то мы на финише участка
+            if self._odo >= self._cum_dist[-1]:
+                _waypoints_passed.inc(len(self._track) - self._track_idx)
+                overshoot = self._odo - self._cum_dist[-1]
+                self._cur_loc = self._target_loc
+                self._track = None
+                self._reset_route()
+                if self._next_leg():
+                    # Следующий участок проходим с момента прибытия в точку
+                    self._sync_time = ts - overshoot / (self._speed / 3.6) if self._speed else ts
+                else:
                     self._speed = 0
-                    self._track = None
-                    break
-                # Проскочили точку, едем дальше
-                delta_s -= dist
-                del self._track[0]
-
-        # Запоминаем время произведенных вычислений
-        self._sync_time = ts
+            else:
+                prev_idx = self._track_idx
+                idx = self._place_on_route()
+                if idx > prev_idx:
+                    _waypoints_passed.inc(idx - prev_idx)
+                break
+
+        # Запоминаем время произведенных вычислений (пока строится участок, время отсчитываем от прибытия)
+        if not self._planning:
+            self._sync_time = ts
+        # События входа/выхода из геозон (индекс пропускает трекер, если положение не изменилось)
+        if Tracker.geofences is not None:
+            Tracker.geofences.update(self.name, *self._cur_loc.pos, ts)
 
     speed = property(get_speed, set_speed)
+
+
+# Прогнать трекер на ручных часах (clock.ManualClock, те же, что у трекера) с шагом step секунд:
+# генератор get_position() на каждом шаге, пока трекер движется. Для нагрузочных и регрессионных тестов
+def simulate(tracker, clock, step=1.0, max_steps=None):
+    n = 0
+    while tracker.is_moving() and (max_steps is None or n < max_steps):
+        clock.advance(step)
+        n += 1
+        yield tracker.get_position()
@@ -1,17 +1,15 @@
 import os
+import sys
 import time
-import argparse
 import logging
 import threading
 import signal
 import json
 
-import daemon
-from daemon import pidfile
-from lockfile import AlreadyLocked
-
-import location
+# Клиентская часть (main для всех команд, кроме запуска демона) использует только ipc.
+# Тяжелые модули (pyproj, openrouteservice, python-daemon, asyncio) импортируются только в демоне
 import ipc
+import metrics
 
 from config import *
 
@@ -19,40 +17,183 @@ from config import *
 logger = logging.getLogger('locd')
 logger.setLevel(logging.DEBUG)
 
+COMMANDS = ('move', 'route', 'speed', 'status', 'cur', 'track', 'stop', 'start', 'predict', 'subscribe', 'batch', 'metrics',
+            'history', 'fence', 'nearby', 'events')
 
-class FileSaver(threading.Thread):
-    def __init__(self, curf, tracker):  # , lock):
-        threading.Thread.__init__(self, daemon=True)
-        self.stopped = True
+_requests_total = metrics.Counter('locd_requests_total', 'Requests handled by command')
+_request_errors = metrics.Counter('locd_request_errors_total', 'Failed requests by command')
+_request_seconds = metrics.Histogram('locd_request_seconds', 'Request handling time by command')
+_saver_write_seconds = metrics.Histogram('locd_saver_write_seconds', 'Position publication time by target')
+
+
+# Публикация текущего положения, пока трекер движется: каждые REFRESH_CUR_TIME сек в разделяемую
+# память (shmpos), в текстовый curf - атомарно и не чаще CUR_FILE_SAVE_TIME сек (для перезапуска демона),
+# в историю (history) - каждая новая точка, на диск пачками вместе с curf,
+# в снапшот (snapshot.SnapshotStore) - полное состояние при смене маршрута, иначе запись прогресса в журнал.
+# Поток создается заново при каждом start(), поэтому сохранение можно перезапускать после остановки
+class FileSaver:
+    def __init__(self, curf, tracker, lock, shmf=None, history=None, snapshots=None):
         self.tracker = tracker
         self.curf = curf
-        # self.lock = lock
+        self.lock = lock
+        if shmf:
+            import shmpos
+            self.shm = shmpos.PosWriter(shmf)
+        else:
+            self.shm = None
+        self.history = history
+        self.snapshots = snapshots
+        self._snap_ver = None
+        self._thrd = None
+        self._running = False
+        self._state_lock = threading.Lock()
+        # Запись на диск из потока и из stop() по очереди, и не старее уже записанного состояния
+        self._io_lock = threading.Lock()
+        self._gather_seq = 0
+        self._written_seq = 0
+        self._stop_evt = threading.Event()
+        self._file_ts = 0
+        self._hist_odo = None
+
+    @property
+    def stopped(self):
+        return not self._running
+
+    def start(self):
+        with self._state_lock:
+            if self._running:
+                return
+            self._running = True
+            self._stop_evt.clear()
+            self._thrd = threading.Thread(target=self.run, daemon=True)
+            self._thrd.start()
 
     def run(self):
         logger.info('Starting cur file save...')
-        self.stopped = False
-        while self.tracker.get_track() and not self.stopped:
-            self.save_once()
-            time.sleep(REFRESH_CUR_TIME)
-        self.stopped = True
+        try:
+            while True:
+                moving = self.save_once()
+                with self._state_lock:
+                    # Трек перепроверяем под блокировкой: новый move мог прийти после save_once
+                    if self._stop_evt.is_set() or not (moving or self.tracker.is_moving()):
+                        self._running = False
+                        break
+                self._stop_evt.wait(REFRESH_CUR_TIME)
+        except Exception:
+            logger.exception('Cur file save failed')
+        finally:
+            # Иначе после ошибки start() считал бы поток живым и больше его не запускал
+            with self._state_lock:
+                self._running = False
         logger.info('Stopped cur file save')
 
+    # Последнее сохранение. Поток не ждем: stop() вызывается под блокировкой трекера, которая нужна потоку,
+    # его запись, начатая раньше, либо выполнится до нашей, либо будет пропущена
     def stop(self):
-        self.save_once()
-        self.stopped = True
+        self._stop_evt.set()
+        self.save_once(force_file=True, final=True)
+
+    # Опубликовать положение, вернуть True, если трекер еще движется
+    def save_once(self, force_file=False, final=False):
+        with self.lock:
+            # После stop() пишет только сам stop()
+            if self._stop_evt.is_set() and not final:
+                return False
+            pos = self.tracker.get_position()
+            moving = self.tracker.is_moving()
+            # Под блокировкой только собираем ссылки, сериализация и запись - уже без нее
+            state = self.tracker.dump_state() if self.snapshots else None
+            self._gather_seq += 1
+            seq = self._gather_seq
+        with self._io_lock:
+            # Более новое состояние уже записано
+            if seq < self._written_seq:
+                return moving
+            self._written_seq = seq
+            self._write(pos, state, moving, force_file)
+        return moving
+
+    def _write(self, pos, state, moving, force_file):
+        lat, lon = pos['cur_loc']
+
+        if self.snapshots:
+            if state['route_ver'] != self._snap_ver or self.snapshots.journal_size >= SNAPSHOT_JOURNAL_MAX:
+                with _saver_write_seconds.time(target='snapshot'):
+                    self.snapshots.save(state)
+                self._snap_ver = state['route_ver']
+            else:
+                with _saver_write_seconds.time(target='journal'):
+                    self.snapshots.journal(state['sync_time'], state['odo'], state['speed'])
+
+        if self.shm:
+            with _saver_write_seconds.time(target='shm'):
+                self.shm.write(lat, lon, pos['ts'], pos['speed'], pos['azimuth'], pos['odo'])
+
+        if self.history:
+            # Стоящий трекер не пишем: точка добавляется, только если odo изменился
+            if self._hist_odo != pos['odo']:
+                self.history.append(pos['ts'], lat, lon, pos['speed'], pos['odo'])
+                self._hist_odo = pos['odo']
+
+        if force_file or not moving or time.time() - self._file_ts >= CUR_FILE_SAVE_TIME:
+            with _saver_write_seconds.time(target='file'):
+                # Пишем во временный файл и переименовываем, чтобы читатель не увидел файл наполовину
+                tmpf = f'{self.curf}.tmp'
+                with open(tmpf, 'w') as f:
+                    f.write(f'{lat},{lon}')
+                os.replace(tmpf, self.curf)
+            if self.history:
+                with _saver_write_seconds.time(target='history'):
+                    self.history.flush()
+            self._file_ts = time.time()
+
+
+# Раз в tick секунд считает положение трекера и рассылает его подписчикам сервера
+class PosPublisher(threading.Thread):
+    def __init__(self, server, tracker, lock, tick=SUBSCRIBE_TICK):
+        threading.Thread.__init__(self, daemon=True)
+        self.stopped = False
+        self.server = server
+        self.tracker = tracker
+        self.lock = lock
+        self.tick = tick
+        self._log_limiter = metrics.RateLimiter(LOG_REQUEST_INTERVAL)
 
-    def save_once(self):
-        # with self.lock:
-        lat, lon = self.tracker.accurate_loc().pos
+    def run(self):
+        while not self.stopped:
+            # Считаем положение один раз на тик для всех подписчиков
+            try:
+                if self.server.has_subscribers():
+                    with self.lock:
+                        frame = self.tracker.get_position()
+                    self.server.publish(frame)
+            except Exception:
+                # Ошибка одного тика не должна останавливать рассылку
+                suppressed = self._log_limiter.allow()
+                if suppressed is not None:
+                    logger.exception('Position publish failed' +
+                                     (f' (and {suppressed} more times since last message)' if suppressed else ''))
+            time.sleep(self.tick)
 
-        with open(self.curf, 'w') as f:
-            f.write(f'{lat},{lon}')
+    def stop(self):
+        self.stopped = True
 
 
 class Locd():
-    def __init__(self, curf=None, pidf=None, sockf=None, logf=None):
+    # time_factor != 1 - ускоренное (замедленное) время трекера, seed - воспроизводимый шум координат
+    def __init__(self, curf=None, pidf=None, sockf=None, logf=None, shmf=None, time_factor=1, seed=None,
+                 cachef=None, histf=None, snapf=None):
         self.curf = curf
-        self.pidlockf = pidfile.TimeoutPIDLockFile(pidf) if pidf else None
+        # Файл снапшота состояния трекера, None - после перезапуска восстанавливается только положение из curf
+        self.snapf = snapf
+        # Файл истории перемещений, None - история не ведется
+        self.histf = histf
+        # Файл кэша маршрутов, None - кэш только в памяти
+        self.cachef = cachef
+        self.time_factor = time_factor
+        self.seed = seed
+        self.shmf = shmf
+        self.pidf = pidf
         self.sockf = sockf
         self._log_fh = logging.FileHandler(logf) if logf else None
 
@@ -61,9 +202,12 @@ class Locd():
 
         self.tracker = None
         self.server = None
-        # self.lock = None
+        self.lock = None
         self.curf_thrd = None
+        self.pub_thrd = None
         self.context = None
+        # Логируем не каждый запрос, а не чаще раза в LOG_REQUEST_INTERVAL сек
+        self._log_limiter = metrics.RateLimiter(LOG_REQUEST_INTERVAL)
 
     @staticmethod
     def _logger_init(fh):
@@ -77,6 +221,12 @@ class Locd():
         logger.addHandler(fh)
 
     def start(self):
+        import random
+        import daemon
+        from daemon import pidfile
+        import location
+        import clock
+
         # TODO: check curf, pidf, logf, sockf
         logger.info(f'Location daemon starting...')
 
@@ -84,12 +234,16 @@ class Locd():
             # TODO: add try/except
             lat, lon = [float(coord) for coord in f.readline().split(',')]
             logger.info(f'Read from {self.curf}: Lat: {lat}, Lon: {lon}')
-        self.tracker = location.Tracker(lat, lon)
+        self.tracker = location.Tracker(lat, lon, name=TRACKER_NAME,
+                                        clock=clock.make_clock(self.time_factor),
+                                        rng=random.Random(self.seed) if self.seed is not None else None)
+        if self.time_factor != 1:
+            logger.info(f'Simulated time x{self.time_factor}')
 
         self.context = daemon.DaemonContext(
             working_directory='./',
             umask=0o002,
-            pidfile=self.pidlockf,
+            pidfile=pidfile.TimeoutPIDLockFile(self.pidf) if self.pidf else None,
             stdout=self._log_fh.stream,
             stderr=self._log_fh.stream,
             # files_preserve=[self._log_fh.stream]
@@ -98,11 +252,73 @@ class Locd():
             self.run()
 
     def run(self):
+        import location
+        import routecache
+        import routing
+        import aioipc
+        import geofence
+        from concurrent.futures import ThreadPoolExecutor
+
         logger.info(f'Location daemon STARTED!')
 
-        self.server = ipc.Server(self.sockf, self._req_handler)
-        # self.lock = threading.RLock()
-        self.curf_thrd = FileSaver(self.curf, self.tracker)  # , self.lock)
+        if LOCAL_GRAPH_FILE:
+            routing.register('local', routing.GraphBackend.load(LOCAL_GRAPH_FILE))
+            logger.info(f'Loaded road graph from {LOCAL_GRAPH_FILE}')
+
+        location.Tracker.route_cache = routecache.RouteCache(self.cachef,
+                                                             mem_size=ROUTE_CACHE_MEM_SIZE,
+                                                             disk_size=ROUTE_CACHE_DISK_SIZE,
+                                                             ttl=ROUTE_CACHE_TTL,
+                                                             precision=ROUTE_CACHE_PRECISION)
+
+        # move возвращается сразу, маршрут строится в фоне
+        location.Tracker.planner = ThreadPoolExecutor(max_workers=ROUTE_WORKERS, thread_name_prefix='route')
+        location.Tracker.debounce = ROUTE_DEBOUNCE
+        location.Tracker.dedupe_dist = ROUTE_DEDUPE_DIST
+        location.Tracker.simplify_tolerance = ROUTE_SIMPLIFY_TOLERANCE
+        location.Tracker.densify_spacing = ROUTE_DENSIFY_SPACING
+
+        self.server = aioipc.Server(self.sockf, self._req_handler)
+
+        # События входа/выхода из геозон уходят подписчикам команды events
+        listener = lambda event: self.server.publish(event, topic='events')
+        if GEOFENCE_FILE and os.path.exists(GEOFENCE_FILE):
+            location.Tracker.geofences = geofence.GeoIndex.load(GEOFENCE_FILE, cell=GEOFENCE_CELL, listener=listener)
+            logger.info(f'Loaded {len(location.Tracker.geofences)} geofences from {GEOFENCE_FILE}')
+        else:
+            location.Tracker.geofences = geofence.GeoIndex(cell=GEOFENCE_CELL, listener=listener)
+
+        metrics.Gauge('locd_route_cache_mem_entries', 'Routes in memory tier of route cache',
+                      fn=lambda: location.Tracker.route_cache.stats()['mem_size'])
+        metrics.Gauge('locd_route_cache_mem_bytes', 'Encoded geometry size in memory tier of route cache',
+                      fn=lambda: location.Tracker.route_cache.stats()['mem_bytes'])
+        metrics.Gauge('locd_route_cache_disk_entries', 'Routes in file tier of route cache',
+                      fn=lambda: location.Tracker.route_cache.stats()['disk_size'])
+        metrics.Gauge('locd_subscribers', 'Position and event stream subscribers', fn=lambda: self.server.subscribers())
+        metrics.Gauge('locd_geofences', 'Geofences in spatial index', fn=lambda: len(location.Tracker.geofences))
+        # Обработчики запросов выполняются в пуле потоков сервера, трекер общий
+        self.lock = threading.RLock()
+        history = None
+        if self.histf:
+            import history as history_mod
+            history = history_mod.HistoryWriter(self.histf, batch_size=HISTORY_BATCH)
+        snapshots = None
+        if self.snapf:
+            import snapshot
+            snapshots = snapshot.SnapshotStore(self.snapf)
+            # Продолжаем маршрут прошлого запуска, трек берется из снапшота, без запроса к бэкенду
+            state = snapshots.load()
+            if state:
+                self.tracker.load_state(state)
+                logger.info(f'Restored tracker state from {self.snapf}: {self.tracker.get_state()}')
+        self.curf_thrd = FileSaver(self.curf, self.tracker, self.lock, self.shmf, history, snapshots)
+        # Сразу публикуем начальное положение, а если маршрут восстановлен - продолжаем движение
+        if self.tracker.is_moving():
+            self.curf_thrd.start()
+        else:
+            self.curf_thrd.save_once()
+        self.pub_thrd = PosPublisher(self.server, self.tracker, self.lock)
+        self.pub_thrd.start()
 
         with self.server:
             self.server.serve_forever()
@@ -128,63 +344,259 @@ class Locd():
             # TODO: raise exception
             return {}
 
-    def is_running(self):
-        if not self.pidlockf: return False
+    # PID из pid-файла демона (формат lockfile.pidlockfile: pid в первой строке)
+    def read_pid(self):
         try:
-            self.pidlockf.acquire()
+            with open(self.pidf, 'r') as f:
+                return int(f.readline().strip())
+        except (OSError, ValueError):
+            return None
+
+    def is_running(self):
+        if not self.pidf: return False
+        pid = self.read_pid()
+        if pid is None:
             # daemon stopped
-            self.pidlockf.release()
             return False
-        except AlreadyLocked:
+        try:
+            os.kill(pid, 0)
+            # daemon running
+            return True
+        except PermissionError:  # process exists, but owned by another user
+            return True
+        except OSError:  # No process with locked PID
+            # daemon been killed (stopped)
             try:
-                os.kill(self.pidlockf.read_pid(), 0)
-                # daemon running
-                return True
-            except OSError:  # No process with locked PID
-                # daemon been killed (stopped)
-                self.pidlockf.break_lock()
-                return False
+                os.unlink(self.pidf)
+            except OSError:
+                pass
+            return False
 
     def kill(self):
         if self.is_running():
-            self.curf_thrd.stop()
-            os.kill(self.pidlockf.read_pid(), signal.SIGTERM)
+            try:
+                # Останавливаем и движение: после перезапуска трекер стоит в текущей точке
+                self.tracker.set_pos(*self.tracker.accurate_loc().pos)
+                self.curf_thrd.stop()
+            finally:
+                os.kill(self.read_pid(), signal.SIGTERM)
             logger.info(f'Location daemon STOPPED!')
 
     def _req_handler(self, req):
-        logger.info(f'Got request by location daemon')
-        # with self.lock:
+        cmd = req.get('cmd') if isinstance(req, dict) else None
+        if cmd not in COMMANDS:
+            cmd = 'other'
+        suppressed = self._log_limiter.allow()
+        if suppressed is not None:
+            logger.debug(f'Got request by location daemon: {cmd}' +
+                         (f' (and {suppressed} more since last message)' if suppressed else ''))
+        _requests_total.inc(cmd=cmd)
+        try:
+            with _request_seconds.time(cmd=cmd):
+                with self.lock:
+                    return self._handle_cmd(req)
+        except Exception as e:
+            _request_errors.inc(cmd=cmd)
+            logger.error(f'Request {cmd} failed: {type(e).__name__}: {e}')
+            raise
+
+    def _handle_cmd(self, req):
         if req['cmd'] == 'move':
-            self.tracker.move_to(req['lat'], req['lon'])
+            self.tracker.move_to(req['lat'], req['lon'], prof=req.get('prof'))
+            self.curf_thrd.start()
+            return self.tracker.get_status()
+        elif req['cmd'] == 'route':
+            self.tracker.route_to(req['points'], speed=req.get('spd', 3), prof=req.get('prof'))
             self.curf_thrd.start()
             return self.tracker.get_status()
         elif req['cmd'] == 'speed':
             self.tracker.speed = req['spd']
+            self.curf_thrd.start()
             return self.tracker.get_status()
         elif req['cmd'] == 'status':
-            return self.tracker.get_status()
+            status = self.tracker.get_status(track=req.get('track', False), track_ver=req.get('track_ver'))
+            if self.tracker.route_cache:
+                status['route_cache'] = self.tracker.route_cache.stats()
+            return status
         elif req['cmd'] == 'cur':
             return {'cur_loc': self.tracker.accurate_loc().pos}
         elif req['cmd'] == 'track':
             self.tracker.accurate_loc()
-            return {'track': self.tracker.get_track()}
+            return self.tracker.get_track_page(req.get('offset'), req.get('limit'), req.get('format') == 'polyline')
         elif req['cmd'] == 'stop':
             self.kill()
         elif req['cmd'] == 'start':
             return self.tracker.get_status()
+        elif req['cmd'] == 'predict':
+            return self.tracker.predict(times=req.get('times') or (),
+                                        after=req.get('after') or (),
+                                        dists=req.get('dists') or ())
+        elif req['cmd'] == 'subscribe':
+            return self._subscribe(req.get('interval', 1.0), req.get('min_dist', 0))
+        elif req['cmd'] == 'metrics':
+            return metrics.render()
+        elif req['cmd'] == 'fence':
+            return self._fence(req)
+        elif req['cmd'] == 'nearby':
+            # Положение трекера в индексе - на текущий момент
+            self.tracker.accurate_loc()
+            return self.tracker.geofences.nearby(req['lat'], req['lon'], req['radius'])
+        elif req['cmd'] == 'events':
+            import aioipc
+            return aioipc.Subscription(ack={'fences': self.tracker.geofences.inside(self.tracker.name)},
+                                       topic='events', queue=GEOFENCE_EVENT_QUEUE)
+        elif req['cmd'] == 'history':
+            return self._history(req.get('from'), req.get('to'), req.get('limit'))
+        elif req['cmd'] == 'batch':
+            # Несколько команд за один запрос, результаты в том же порядке.
+            # Подписки не сериализуются в ответ, а stop остановил бы демон посреди пачки
+            for sub_req in req['cmds']:
+                if sub_req.get('cmd') in ('subscribe', 'events', 'stop', 'batch'):
+                    raise ValueError(f"Command {sub_req['cmd']} is not allowed in batch")
+            return [self._handle_cmd(sub_req) for sub_req in req['cmds']]
+
+
+    # Записи истории (ts, lat, lon, speed, odo) за интервал времени [from, to], не больше limit
+    # (и не больше HISTORY_QUERY_LIMIT)
+    def _history(self, start_ts, end_ts, limit=None):
+        import history
+
+        limit = HISTORY_QUERY_LIMIT if limit is None else min(limit, HISTORY_QUERY_LIMIT)
+
+        saver_history = self.curf_thrd.history
+        if not saver_history:
+            return {'records': [], 'count': 0}
+        # Отдаем и еще не сброшенные на диск точки
+        saver_history.flush()
+        with history.HistoryReader(self.histf) as reader:
+            records = list(reader.range(start_ts, end_ts, limit))
+        return {'records': records, 'count': len(records)}
+
+    # Управление геозонами: op = add (name и circle [lat, lon, radius] или polygon [[lat, lon], ...]), remove, list
+    def _fence(self, req):
+        import geofence
+
+        index = self.tracker.geofences
+        op = req.get('op', 'list')
+        if op == 'list':
+            return {'fences': index.fences()}
+        if op == 'add':
+            index.add(geofence.fence_from_dict({key: value for key, value in req.items()
+                                                if key in ('name', 'circle', 'polygon') and value is not None}))
+            result = {'added': req['name']}
+        elif op == 'remove':
+            result = {'removed': index.remove(req['name'])}
+        else:
+            raise ValueError(f'Unknown fence operation: {op}')
+        if GEOFENCE_FILE:
+            index.save(GEOFENCE_FILE)
+        result['count'] = len(index)
+        return result
+
+    # Подписка на положение: кадр не чаще interval сек и только при смещении от последнего кадра
+    # не меньше min_dist метров (или при изменении скорости)
+    def _subscribe(self, interval, min_dist):
+        import location
+        import aioipc
+
+        def accept(frame, last_frame):
+            if frame['speed'] != last_frame['speed']:
+                return True
+            _, dist = location.Location(*last_frame['cur_loc']).inv(*frame['cur_loc'])
+            return dist >= min_dist
+
+        return aioipc.Subscription(ack=self.tracker.get_position(),
+                                interval=max(interval, SUBSCRIBE_TICK),
+                                accept=accept if min_dist > 0 else None)
+
+
+# Долгоживущий клиент демона: одно соединение на много запросов, без проверки pid-файла на каждый вызов
+class LocdClient:
+    def __init__(self, sockf=SOCK_FILE, encoding='msgpack'):
+        self.sockf = sockf
+        self.encoding = encoding
+        self._client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._client:
+            self._client.close()
+            self._client = None
+
+    def request(self, args):
+        try:
+            self._write(args)
+        except (ipc.ConnectionClosed, ConnectionError):
+            # Соединение могло устареть (например, демон перезапускался) - переподключаемся один раз.
+            # Повторяем только неотправленный запрос: дошедший до демона не должен выполниться дважды
+            self.close()
+            self._write(args)
+        try:
+            return self._client.reply()
+        except (ipc.ConnectionClosed, ConnectionError):
+            self.close()
+            if args['cmd'] != 'stop':
+                raise
+            return {}
+
+    def batch(self, *cmds):
+        return self.request({'cmd': 'batch', 'cmds': list(cmds)})
+
+    # Генератор кадров положения по отдельному соединению (первый кадр - текущее положение)
+    def subscribe(self, interval=1.0, min_dist=0):
+        return self._stream({'cmd': 'subscribe', 'interval': interval, 'min_dist': min_dist})
+
+    # Генератор событий входа/выхода из геозон (первый кадр - {'fences': зоны, в которых сейчас трекер})
+    def events(self):
+        return self._stream({'cmd': 'events'})
+
+    def _stream(self, args):
+        with ipc.Client(self.sockf, self.encoding) as client:
+            try:
+                yield client.send(args)
+                while True:
+                    yield client.recv()
+            except ipc.ConnectionClosed:
+                return
+
+    def _write(self, args):
+        if not self._client:
+            client = ipc.Client(self.sockf, self.encoding)
+            try:
+                client.connect()
+            except (FileNotFoundError, ConnectionRefusedError):
+                client.close()
+                raise ipc.IPCError(f'Location daemon is not running on {self.sockf}')
+            self._client = client
+        self._client.write(args)
 
 
 def main(*argc, **kwargs):
     if argc:
         kwargs['cmd'] = argc[0]
     cur_file = kwargs.pop('cur_file') if 'cur_file' in kwargs else CUR_LOC_FILE
+    cache_file = kwargs.pop('cache_file') if 'cache_file' in kwargs else ROUTE_CACHE_FILE
+    hist_file = kwargs.pop('hist_file') if 'hist_file' in kwargs else HISTORY_FILE
+    snap_file = kwargs.pop('snap_file') if 'snap_file' in kwargs else SNAPSHOT_FILE
     pid_file = kwargs.pop('pid_file') if 'pid_file' in kwargs else PID_FILE
     sock_file = kwargs.pop('sock_file') if 'sock_file' in kwargs else SOCK_FILE
     log_file = kwargs.pop('log_file') if 'log_file' in kwargs else LOG_FILE
+    shm_file = kwargs.pop('shm_file') if 'shm_file' in kwargs else CUR_SHM_FILE
+    time_factor = kwargs.pop('time_factor', None) or SIM_TIME_FACTOR
+    seed = kwargs.pop('seed', None)
+    if seed is None:
+        seed = SIM_SEED
 
-    loc_daemon = Locd(curf=cur_file, pidf=pid_file, sockf=sock_file, logf=log_file)
+    loc_daemon = Locd(curf=cur_file, pidf=pid_file, sockf=sock_file, logf=log_file, shmf=shm_file,
+                      time_factor=time_factor, seed=seed, cachef=cache_file, histf=hist_file,
+                      snapf=snap_file)
 
-    if kwargs['cmd'] in ['start', 'move'] and not loc_daemon.is_running():
+    if kwargs['cmd'] in ['start', 'move', 'route'] and not loc_daemon.is_running():
         loc_daemon.start()
 
     result = {'online': loc_daemon.is_running(),
@@ -207,35 +619,138 @@ def main(*argc, **kwargs):
 
 
 if __name__ == "__main__":
+    import argparse
+
     parser = argparse.ArgumentParser(description="Location daemon starter/wrapper")
     parser.add_argument('-p', '--pid-file', default=PID_FILE, help='(Default: %(default)s)')
     parser.add_argument('-l', '--log-file', default=LOG_FILE, help='(Default: %(default)s)')
     parser.add_argument('-s', '--sock-file', default=SOCK_FILE, help='(Default: %(default)s)')
     parser.add_argument('-c', '--cur-file', default=CUR_LOC_FILE, help='(Default: %(default)s)')
+    parser.add_argument('-m', '--shm-file', default=CUR_SHM_FILE, help='(Default: %(default)s)')
+    parser.add_argument('-r', '--cache-file', default=ROUTE_CACHE_FILE, help='(Default: %(default)s)')
+    parser.add_argument('-H', '--hist-file', default=HISTORY_FILE, help='(Default: %(default)s)')
+    parser.add_argument('-S', '--snap-file', default=SNAPSHOT_FILE, help='(Default: %(default)s)')
 
     subparsers = parser.add_subparsers(dest='cmd', help='sub-command help')
 
-    subparsers.add_parser('status', help='Get daemon status')
+    parser_status = subparsers.add_parser('status', help='Get daemon status')
+    parser_status.add_argument('--track', action='store_true', help='Include remaining track')
+    parser_status.add_argument('--track-ver', type=int, help='Include track only if it changed since this version')
 
     subparsers.add_parser('cur', help='Get current location')
 
-    subparsers.add_parser('start', help='Start daemon and stay it alive')
+    parser_start = subparsers.add_parser('start', help='Start daemon and stay it alive')
+    parser_start.add_argument('--time-factor', type=float, help='Run tracker time N times faster '
+                                                                '(Default: SIM_TIME_FACTOR from config)')
+    parser_start.add_argument('--seed', type=int, help='Seed for location noise (Default: SIM_SEED from config)')
 
     parser_move = subparsers.add_parser('move', help='Move to point with given latitude and longitude'
                                                      '(Daemon will automaticaly start)')
     parser_move.add_argument('lat', type=float, help='Latitude of point')
     parser_move.add_argument('lon', type=float, help='Longitude of point')
+    parser_move.add_argument('--prof', help='Route profile, e.g. driving-car or local:foot-walking '
+                                            '(Default: keep current)')
     # parser_move.add_argument('-k', help='Kill the deamon if movement had finished')
 
+    parser_route = subparsers.add_parser('route', help='Move through several points in order '
+                                                       '(Daemon will automaticaly start)')
+    parser_route.add_argument('points', nargs='+', type=lambda pnt: [float(c) for c in pnt.split(',')],
+                              help='Points as lat,lon, e.g. 55.794,37.799 55.795,37.801')
+    parser_route.add_argument('--spd', type=float, default=3, help='Speed in km/h (Default: %(default)s)')
+    parser_route.add_argument('--prof', help='Route profile (Default: keep current)')
+
     subparsers.add_parser('stop', help='Stop movement and daemon')
 
-    subparsers.add_parser('track', help='Get current waypoints track')
+    parser_track = subparsers.add_parser('track', help='Get current waypoints track')
+    parser_track.add_argument('--offset', type=int, help='First point number in the whole track '
+                                                         '("next" from previous page)')
+    parser_track.add_argument('-n', '--limit', type=int, help='Max number of points')
+    parser_track.add_argument('--polyline', dest='format', action='store_const', const='polyline',
+                              help='Return points as encoded polyline')
+
+    subparsers.add_parser('metrics', help='Get daemon metrics (Prometheus text format)')
+
+    parser_predict = subparsers.add_parser('predict', help='Predict positions along the track and ETA')
+    parser_predict.add_argument('-a', '--after', type=float, nargs='+', help='Seconds from now, e.g. 10 60 300')
+    parser_predict.add_argument('-d', '--dists', type=float, nargs='+', help='Meters ahead along the track')
+
+    parser_sub = subparsers.add_parser('subscribe', help='Stream position updates (one JSON line per frame)')
+    parser_sub.add_argument('-i', '--interval', type=float, default=1.0, help='Min seconds between frames '
+                                                                              '(Default: %(default)s)')
+    parser_sub.add_argument('-d', '--min-dist', type=float, default=0, help='Min movement in meters between '
+                                                                            'frames (Default: %(default)s)')
+
+    parser_hist = subparsers.add_parser('history', help='Export movement history for time range '
+                                                        '(works without daemon)')
+    parser_hist.add_argument('--from', dest='from_ts', type=float, help='Start unix time')
+    parser_hist.add_argument('--to', dest='to_ts', type=float, help='End unix time')
+    parser_hist.add_argument('-n', '--limit', type=int, help='Max number of points')
+    parser_hist.add_argument('-f', '--format', choices=('json', 'gpx', 'geojson'), default='json',
+                             help='json - one record per line (Default: %(default)s)')
+
+    parser_fence = subparsers.add_parser('fence', help='Manage geofences')
+    fence_ops = parser_fence.add_subparsers(dest='op', required=True)
+    fence_add = fence_ops.add_parser('add', help='Add (or replace) geofence')
+    fence_add.add_argument('name')
+    fence_shape = fence_add.add_mutually_exclusive_group(required=True)
+    fence_shape.add_argument('--circle', type=float, nargs=3, metavar=('LAT', 'LON', 'RADIUS'),
+                             help='Circle with radius in meters')
+    fence_shape.add_argument('--polygon', nargs='+', type=lambda pnt: [float(c) for c in pnt.split(',')],
+                             help='Polygon vertices as lat,lon')
+    fence_remove = fence_ops.add_parser('remove', help='Remove geofence')
+    fence_remove.add_argument('name')
+    fence_ops.add_parser('list', help='List geofences')
+
+    parser_nearby = subparsers.add_parser('nearby', help='Trackers and geofences within radius of point')
+    parser_nearby.add_argument('lat', type=float, help='Latitude of point')
+    parser_nearby.add_argument('lon', type=float, help='Longitude of point')
+    parser_nearby.add_argument('-r', '--radius', type=float, default=100, help='Meters (Default: %(default)s)')
+
+    subparsers.add_parser('events', help='Stream geofence enter/exit events (one JSON line per event)')
 
     parser_speed = subparsers.add_parser('speed', help='Setup current movement speed')
     parser_speed.add_argument('spd', type=float, help='Speed in km/h')
 
+    parser_batch = subparsers.add_parser('batch', help='Run several commands in one request')
+    parser_batch.add_argument('cmds', type=json.loads,
+                              help='JSON list of commands, e.g. \'[{"cmd": "cur"}, {"cmd": "track"}]\'')
+
     kwargs = vars(parser.parse_args())
 
+    if kwargs['cmd'] in ('subscribe', 'events'):
+        with LocdClient(kwargs['sock_file']) as client:
+            if kwargs['cmd'] == 'subscribe':
+                frames = client.subscribe(kwargs['interval'], kwargs['min_dist'])
+            else:
+                frames = client.events()
+            for frame in frames:
+                print(json.dumps(frame), flush=True)
+        sys.exit()
+
+    if kwargs['cmd'] == 'history':
+        import history
+        if not kwargs['hist_file']:
+            parser.error('history is disabled: set HISTORY_FILE in config.py or pass -H/--hist-file')
+        # Файл читается напрямую (и без демона), демона только просим сбросить накопленные точки
+        try:
+            with LocdClient(kwargs['sock_file']) as client:
+                client.request({'cmd': 'history', 'limit': 0})
+        except ipc.IPCError:
+            pass
+        with history.HistoryReader(kwargs['hist_file']) as reader:
+            records = reader.range(kwargs['from_ts'], kwargs['to_ts'], kwargs['limit'])
+            if kwargs['format'] == 'json':
+                for record in records:
+                    print(json.dumps(dict(zip(history.FIELDS, record))))
+            else:
+                for chunk in history.EXPORTS[kwargs['format']](records):
+                    sys.stdout.write(chunk)
+        sys.exit()
+
     result = main(**kwargs)
 
+    if kwargs['cmd'] == 'metrics' and result['online']:
+        print(result['status'], end='')
+        sys.exit()
+
     print(json.dumps(result))
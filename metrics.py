@@ -0,0 +1,152 @@
+import time
+import threading
+from bisect import bisect_left
+
+# Метрики демона в памяти процесса (счетчики, гистограммы, gauge) и вывод в текстовом формате Prometheus.
+# Все метрики регистрируются в общем реестре при создании, метрика с тем же именем заменяет прежнюю
+
+_registry = {}
+_lock = threading.Lock()
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in items) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        _registry[name] = self
+
+    def inc(self, value=1, **labels):
+        key = _labels_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self._values.get(_labels_key(labels), 0)
+
+    def _samples(self):
+        return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+# Значение задается set() или вычисляется функцией fn при выводе
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self._values = {}
+        _registry[name] = self
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_labels_key(labels)] = value
+
+    def _samples(self):
+        if self.fn:
+            value = self.fn()
+            return [] if value is None else [(self.name, (), (), value)]
+        return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # key -> [счетчики по корзинам (не накопленные) + переполнение, сумма, количество]
+        self._values = {}
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        idx = bisect_left(self.buckets, value)
+        with _lock:
+            item = self._values.get(key)
+            if item is None:
+                item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            item[0][idx] += 1
+            item[1] += value
+            item[2] += 1
+
+    # Замер времени выполнения блока: with hist.time(cmd='cur'): ...
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cum = 0
+            for bound, n in zip(self.buckets, counts):
+                cum += n
+                samples.append((f'{self.name}_bucket', key, (('le', repr(bound)),), cum))
+            samples.append((f'{self.name}_bucket', key, (('le', '+Inf'),), count))
+            samples.append((f'{self.name}_sum', key, (), total))
+            samples.append((f'{self.name}_count', key, (), count))
+        return samples
+
+
+class _Timer:
+    __slots__ = ('_hist', '_labels', '_ts')
+
+    def __init__(self, hist, labels):
+        self._hist = hist
+        self._labels = labels
+
+    def __enter__(self):
+        self._ts = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._hist.observe(time.perf_counter() - self._ts, **self._labels)
+
+
+# Все метрики в текстовом формате Prometheus (text/plain; version=0.0.4)
+def render():
+    lines = []
+    with _lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        with _lock:
+            samples = metric._samples()
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, key, extra, value in samples:
+            lines.append(f'{name}{_format_labels(key, extra)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Пропускает не чаще одного события в interval секунд (например, для логирования каждого запроса)
+class RateLimiter:
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_ts = 0.0
+        self._suppressed = 0
+
+    # None - событие пропустить, иначе число пропущенных с прошлого разрешенного
+    def allow(self):
+        ts = time.monotonic()
+        if ts < self._next_ts:
+            self._suppressed += 1
+            return None
+        self._next_ts = ts + self.interval
+        suppressed, self._suppressed = self._suppressed, 0
+        return suppressed
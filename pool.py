@@ -0,0 +1,195 @@
+import numpy as np
+import pyproj
+
+import location
+import clock as clocks
+
+# Пул трекеров в виде структуры массивов (NumPy): положения, скорости, одометры и индексы сегментов
+# N трекеров продвигаются одним шагом step() с векторными Geod.fwd. Требует numpy.
+#
+# Сегменты всех маршрутов хранятся в общих растущих массивах. Накопленное расстояние _cum
+# глобально монотонно (у каждого маршрута своя база base), поэтому текущий сегмент
+# всех трекеров находится одним np.searchsorted
+
+_geod = pyproj.Geod(ellps='WGS84')
+
+
+class TrackerPool:
+    def __init__(self, lats, lons, prof='foot-walking', clock=None):
+        self.prof = prof
+        self.clock = clock or clocks.WALL
+        self.lat = np.array(lats, dtype=np.float64)
+        self.lon = np.array(lons, dtype=np.float64)
+        n = len(self.lat)
+        self.target_lat = self.lat.copy()
+        self.target_lon = self.lon.copy()
+        self.speed = np.zeros(n)  # км/ч
+        self.odo = np.zeros(n)  # м, от начала текущего маршрута
+        self.azimuth = np.full(n, np.nan)
+        self.sync_time = np.full(n, self.clock.time())
+        # Маршрут трекера: сегменты [off, off + nseg) в общих массивах, off = -1 - маршрута нет
+        self.off = np.full(n, -1, dtype=np.int64)
+        self.nseg = np.zeros(n, dtype=np.int64)
+        self.seg_idx = np.zeros(n, dtype=np.int64)
+        self.base = np.zeros(n)
+        self.total = np.zeros(n)
+        # Версия маршрута (как Tracker track_ver): меняется при каждой смене маршрута и по прибытии
+        self.route_ver = np.ones(n, dtype=np.int64)
+
+        self._used = 0
+        self._live = 0
+        self._cum_end = 0.0
+        self._alloc(1024)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _alloc(self, cap):
+        old = getattr(self, '_lat0', None)
+        arrays = {}
+        for name in ('_lat0', '_lon0', '_lat1', '_lon1', '_az', '_cum'):
+            arr = np.empty(cap)
+            if old is not None:
+                arr[:self._used] = getattr(self, name)[:self._used]
+            arrays[name] = arr
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+
+    # Задать трекеру i трек [(lat, lon), ...] (последняя точка - цель) и скорость speed (км/ч)
+    def set_route(self, i, track, speed=None):
+        self._drop_route(i)
+        self.route_ver[i] += 1
+        # Движение по новому маршруту отсчитывается от момента его задания
+        self.sync_time[i] = self.clock.time()
+        self.odo[i] = 0.0
+        self.seg_idx[i] = 0
+        if speed is not None:
+            self.speed[i] = speed
+        if not track:
+            self.speed[i] = 0
+            return
+        pts = np.asarray(track, dtype=np.float64)
+        lat0 = np.concatenate(([self.lat[i]], pts[:-1, 0]))
+        lon0 = np.concatenate(([self.lon[i]], pts[:-1, 1]))
+        az, _, dist = _geod.inv(lon0, lat0, pts[:, 1], pts[:, 0])
+        cum = np.concatenate(([0.0], np.cumsum(dist)[:-1]))
+
+        n = len(pts)
+        if self._used + n > len(self._cum):
+            if self._used > 2 * self._live + n:
+                self._compact()
+            if self._used + n > len(self._cum):
+                self._alloc(max(2 * len(self._cum), self._used + n))
+        # База больше всех прежних накопленных расстояний: глобальная монотонность _cum
+        base = self._cum_end + 1.0
+        sl = slice(self._used, self._used + n)
+        self._lat0[sl], self._lon0[sl] = lat0, lon0
+        self._lat1[sl], self._lon1[sl] = pts[:, 0], pts[:, 1]
+        self._az[sl] = az
+        self._cum[sl] = base + cum
+        self.off[i] = self._used
+        self.nseg[i] = n
+        self.seg_idx[i] = self._used
+        self.base[i] = base
+        self.total[i] = float(np.sum(dist))
+        self.target_lat[i], self.target_lon[i] = pts[-1]
+        self._used += n
+        self._live += n
+        self._cum_end = base + self.total[i]
+
+    # Построить маршрут до (lat, lon) бэкендом профиля (синхронно) и начать движение
+    def move_to(self, i, lat, lon, speed=3, prof=None):
+        track = location.Tracker._plan_route((self.lat[i], self.lon[i]), (lat, lon), prof or self.prof)
+        self.set_route(i, track, speed)
+
+    def _drop_route(self, i):
+        if self.off[i] >= 0:
+            self._live -= self.nseg[i]
+            self.off[i] = -1
+            self.nseg[i] = 0
+
+    # Убрать сегменты замененных маршрутов
+    def _compact(self):
+        routed = np.flatnonzero(self.off >= 0)
+        routed = routed[np.argsort(self.off[routed])]
+        pos = 0
+        for i in routed:
+            src = slice(self.off[i], self.off[i] + self.nseg[i])
+            dst = slice(pos, pos + self.nseg[i])
+            for arr in (self._lat0, self._lon0, self._lat1, self._lon1, self._az, self._cum):
+                arr[dst] = arr[src]
+            self.seg_idx[i] += pos - self.off[i]
+            self.off[i] = pos
+            pos += self.nseg[i]
+        self._used = pos
+
+    # Продвинуть все движущиеся трекеры к моменту ts (по умолчанию - текущее время часов пула)
+    def step(self, ts=None):
+        if ts is None:
+            ts = self.clock.time()
+        active = np.flatnonzero((self.off >= 0) & (self.speed > 0))
+        dt = ts - self.sync_time[active]
+        self.sync_time[:] = ts
+        if not len(active):
+            return
+        odo = self.odo[active] + self.speed[active] / 3.6 * dt
+        self.odo[active] = odo
+
+        # Дошедшие до цели
+        done = odo >= self.total[active]
+        fin = active[done]
+        if len(fin):
+            self.lat[fin] = self.target_lat[fin]
+            self.lon[fin] = self.target_lon[fin]
+            self.speed[fin] = 0
+            self.azimuth[fin] = np.nan
+            self.route_ver[fin] += 1
+            self._live -= int(np.sum(self.nseg[fin]))
+            self.off[fin] = -1
+            self.nseg[fin] = 0
+
+        mv = active[~done]
+        if not len(mv):
+            return
+        pos = self.base[mv] + odo[~done]
+        seg = np.searchsorted(self._cum[:self._used], pos, side='right') - 1
+        seg = np.clip(seg, self.off[mv], self.off[mv] + self.nseg[mv] - 1)
+        self.seg_idx[mv] = seg
+        lon, lat, back_az = _geod.fwd(self._lon0[seg], self._lat0[seg], self._az[seg], pos - self._cum[seg])
+        self.lat[mv] = lat
+        self.lon[mv] = lon
+        # Азимут движения в текущей точке - обратный азимут, развернутый на 180
+        self.azimuth[mv] = (back_az + 360.0) % 360.0 - 180.0
+
+    def get_track(self, i):
+        if self.off[i] < 0:
+            return None
+        sl = slice(self.seg_idx[i], self.off[i] + self.nseg[i])
+        return list(zip(self._lat1[sl].tolist(), self._lon1[sl].tolist()))
+
+    def get_state(self, i):
+        return 'moving' if self.off[i] >= 0 else 'idle'
+
+    # Номер текущего сегмента в треке трекера i
+    def get_track_offset(self, i):
+        return int(self.seg_idx[i] - self.off[i]) if self.off[i] >= 0 else 0
+
+    # Те же поля, что и у Tracker.get_status (положение на момент последнего step). Трек - только
+    # по запросу (track) или если версия маршрута отличается от track_ver. Многоточечных маршрутов
+    # у пула нет, поэтому leg и legs_left всегда 0
+    def get_status(self, i, track=False, track_ver=None):
+        az = self.azimuth[i]
+        ver = int(self.route_ver[i])
+        status = {'cur_loc': (float(self.lat[i]), float(self.lon[i])),
+                  'target_loc': (float(self.target_lat[i]), float(self.target_lon[i])),
+                  'speed': float(self.speed[i]),
+                  'azimuth': None if np.isnan(az) else float(az),
+                  'odo': float(self.odo[i]),
+                  'state': self.get_state(i),
+                  'leg': 0,
+                  'legs_left': 0,
+                  'track_ver': ver,
+                  'track_offset': self.get_track_offset(i)}
+        if track or (track_ver is not None and track_ver != ver):
+            status['track'] = self.get_track(i)
+        return status
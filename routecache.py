@@ -0,0 +1,113 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+# Двухуровневый кэш маршрутов: LRU в памяти + sqlite-файл, переживающий перезапуск демона
+class RouteCache:
+    def __init__(self, path=None, mem_size=256, disk_size=10000, ttl=7 * 24 * 3600, precision=4):
+        # precision - число знаков после запятой в ключе (4 знака ~ 11 м)
+        self.precision = precision
+        self.ttl = ttl
+        self.mem_size = mem_size
+        self.disk_size = disk_size
+        self._mem = OrderedDict()  # key -> (geom, created)
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        self._disk_count = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS routes '
+                             '(key TEXT PRIMARY KEY, geom TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS routes_used ON routes (used)')
+            self._purge_expired()
+            self._disk_count = self._db.execute('SELECT COUNT(*) FROM routes').fetchone()[0]
+            self._db.commit()
+
+    # Ключ кэша по округленным координатам начала/конца (lat, lon) и профилю.
+    # variant - параметры обработки геометрии: геометрия с другими параметрами - другая запись
+    def key(self, start, end, prof, variant=None):
+        p = self.precision
+        key = f'{prof}:{start[0]:.{p}f},{start[1]:.{p}f}:{end[0]:.{p}f},{end[1]:.{p}f}'
+        return key if variant is None else f'{key}:{variant}'
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if now - item[1] <= self.ttl:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                self._mem_del(key)
+            if self._db:
+                row = self._db.execute('SELECT geom, created FROM routes WHERE key = ?', (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    self._db.execute('UPDATE routes SET used = ? WHERE key = ?', (now, key))
+                    self._db.commit()
+                    self._mem_put(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, geom):
+        now = time.time()
+        with self._lock:
+            self._mem_put(key, geom, now)
+            if self._db:
+                exists = self._db.execute('SELECT 1 FROM routes WHERE key = ?', (key,)).fetchone()
+                self._db.execute('INSERT OR REPLACE INTO routes (key, geom, created, used) VALUES (?, ?, ?, ?)',
+                                 (key, geom, now, now))
+                if not exists:
+                    self._disk_count += 1
+                # Вытесняем давно не использованные маршруты сверх лимита
+                excess = self._disk_count - self.disk_size
+                if excess > 0:
+                    self._db.execute('DELETE FROM routes WHERE key IN '
+                                     '(SELECT key FROM routes ORDER BY used LIMIT ?)', (excess,))
+                    self._disk_count -= excess
+                    self.evictions += excess
+                self._db.commit()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'mem_size': len(self._mem),
+                'mem_bytes': self._mem_bytes,
+                'disk_size': self._disk_count}
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _mem_put(self, key, geom, created):
+        if key in self._mem:
+            self._mem_del(key)
+        self._mem[key] = (geom, created)
+        self._mem_bytes += len(geom)
+        while len(self._mem) > self.mem_size:
+            self._mem_del(next(iter(self._mem)))
+            # Без файла маршрут из памяти теряется окончательно
+            if not self._db:
+                self.evictions += 1
+
+    def _mem_del(self, key):
+        geom, _ = self._mem.pop(key)
+        self._mem_bytes -= len(geom)
+
+    def _purge_expired(self):
+        self._db.execute('DELETE FROM routes WHERE created < ?', (time.time() - self.ttl,))
@@ -0,0 +1,322 @@
+import math
+import time
+import heapq
+import random
+import threading
+from array import array
+from concurrent.futures import Future
+
+import pyproj
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Бэкенды построения маршрутов. Профиль трекера выбирает бэкенд:
+#   'foot-walking', 'driving-car', ...  - openrouteservice (бэкенд 'ors')
+#   'local:foot-walking'                - бэкенд, зарегистрированный под именем 'local'
+# Бэкенд возвращает геометрию маршрута в формате encoded polyline (как ORS),
+# поэтому кэш маршрутов и декодирование в Tracker работают одинаково для всех бэкендов
+
+_geod = pyproj.Geod(ellps='WGS84')
+_backends = {}
+_ORS_URL = 'https://api.openrouteservice.org'
+_ors_requests = metrics.Counter('locd_ors_requests_total', 'HTTP requests to openrouteservice by result')
+# Средний радиус Земли с запасом: эвристика A* не должна превышать реальное расстояние
+_EARTH_R = 6371008.8 * 0.995
+
+
+class RoutingError(Exception):
+    pass
+
+
+def register(name, backend):
+    _backends[name] = backend
+
+
+# Бэкенд и профиль для него по профилю трекера
+def get_backend(prof):
+    name, sep, sub_prof = prof.partition(':')
+    if not sep:
+        name, sub_prof = 'ors', prof
+    try:
+        return _backends[name], sub_prof
+    except KeyError:
+        raise RoutingError(f'Unknown routing backend: {name}')
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+# Обратное к openrouteservice.convert.decode_polyline: coords - последовательность (lon, lat)
+def encode_polyline(coords, precision=5):
+    factor = 10 ** precision
+    prev_lat = prev_lon = 0
+    chunks = []
+    for lon, lat in coords:
+        lat, lon = round(lat * factor), round(lon * factor)
+        chunks.append(_encode_value(lat - prev_lat))
+        chunks.append(_encode_value(lon - prev_lon))
+        prev_lat, prev_lon = lat, lon
+    return ''.join(chunks)
+
+
+# Ограничитель частоты запросов: rate токенов в секунду, не больше burst подряд.
+# penalize() приостанавливает выдачу токенов всем потокам (например, после ответа 429)
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._ts = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def penalize(self, delay):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+
+# Клиент openrouteservice: общий пул HTTP-соединений, ограничение частоты под квоту ключа,
+# один запрос на одинаковые одновременные маршруты и повторы с экспоненциальной задержкой на 429/5xx
+class ORSBackend:
+    # base_url - другой сервер ORS (например, свой или заглушка для бенчмарков),
+    # rate - запросов в секунду (по умолчанию - квота бесплатного ключа на directions, 40 в минуту)
+    def __init__(self, key, base_url=None, rate=40 / 60, burst=5, pool_size=4, retries=4, backoff=0.5,
+                 backoff_max=30.0, timeout=20.0):
+        self.key = key
+        self.base_url = (base_url or _ORS_URL).rstrip('/')
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self._session = None
+        self._inflight = {}  # (start, end, prof) -> Future
+        self._lock = threading.Lock()
+
+    # Сессия создается при первом запросе
+    @property
+    def session(self):
+        if self._session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Authorization': self.key, 'Content-Type': 'application/json'})
+            self._session = session
+        return self._session
+
+    # start, end - (lat, lon)
+    def directions(self, start, end, prof):
+        key = (tuple(start), tuple(end), prof)
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+        if not leader:
+            # Такой же маршрут уже запрошен другим потоком - ждем его ответ
+            _ors_requests.inc(result='coalesced')
+            return fut.result()
+        try:
+            geom = self._request(start, end, prof)
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(geom)
+            return geom
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _request(self, start, end, prof):
+        body = {'coordinates': [[start[1], start[0]], [end[1], end[0]]]}
+        url = f'{self.base_url}/v2/directions/{prof}/json'
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                resp = self.session.post(url, json=body, timeout=self.timeout)
+            except requests.RequestException as e:
+                status, error, retry_after = None, e, None
+            else:
+                if resp.status_code == 200:
+                    _ors_requests.inc(result='ok')
+                    return resp.json()['routes'][0]['geometry']
+                status, error, retry_after = resp.status_code, resp.text, resp.headers.get('Retry-After')
+                if status != 429 and status < 500:
+                    _ors_requests.inc(result='error')
+                    raise RoutingError(f'ORS error {status}: {error}')
+            if attempt == self.retries:
+                break
+            _ors_requests.inc(result='retry')
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+            delay = min(delay, self.backoff_max)
+            if status == 429:
+                # Квота исчерпана для всего ключа: ждут все потоки
+                self.bucket.penalize(delay)
+            time.sleep(delay)
+        _ors_requests.inc(result='error')
+        raise RoutingError(f'ORS request failed after {self.retries + 1} attempts: {status or error}')
+
+
+# Локальный граф дорог в CSR-представлении (массивы array), маршрут - A* по длине ребер.
+# Формат файла (edge list), строки:
+#   v <id> <lat> <lon>               - вершина
+#   e <id1> <id2> [oneway]           - ребро (длина считается по геодезической), oneway = 1 - одностороннее
+#   # комментарий
+class GraphBackend:
+    # Размер ячейки сетки для поиска ближайшей вершины (градусы)
+    CELL = 0.01
+
+    def __init__(self, lats, lons, edges):
+        # edges - последовательность (u, v) индексов вершин, направленные ребра
+        self.lats = array('d', lats)
+        self.lons = array('d', lons)
+        n = len(self.lats)
+
+        us = array('l', (e[0] for e in edges))
+        vs = array('l', (e[1] for e in edges))
+        if us:
+            _, _, dist = _geod.inv(array('d', (self.lons[u] for u in us)), array('d', (self.lats[u] for u in us)),
+                                   array('d', (self.lons[v] for v in vs)), array('d', (self.lats[v] for v in vs)))
+        else:
+            dist = []
+
+        # CSR: ребра вершины u - indices[indptr[u]:indptr[u + 1]], длины - в weights
+        self.indptr = array('l', [0] * (n + 1))
+        for u in us:
+            self.indptr[u + 1] += 1
+        for i in range(n):
+            self.indptr[i + 1] += self.indptr[i]
+        fill = array('l', self.indptr[:-1])
+        self.indices = array('l', [0] * len(us))
+        self.weights = array('d', [0.0] * len(us))
+        for u, v, d in zip(us, vs, dist):
+            pos = fill[u]
+            self.indices[pos] = v
+            self.weights[pos] = d
+            fill[u] += 1
+
+        self._cells = {}
+        for i in range(n):
+            self._cells.setdefault(self._cell(self.lats[i], self.lons[i]), []).append(i)
+
+    @classmethod
+    def load(cls, path):
+        ids = {}
+        lats = []
+        lons = []
+        edges = []
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if not parts or parts[0].startswith('#'):
+                    continue
+                if parts[0] == 'v':
+                    ids[parts[1]] = len(lats)
+                    lats.append(float(parts[2]))
+                    lons.append(float(parts[3]))
+                elif parts[0] == 'e':
+                    u, v = ids[parts[1]], ids[parts[2]]
+                    edges.append((u, v))
+                    if len(parts) < 4 or parts[3] != '1':
+                        edges.append((v, u))
+        return cls(lats, lons, edges)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.CELL)), int(math.floor(lon / self.CELL))
+
+    # Ближайшая вершина к (lat, lon): обходим кольца ячеек сетки, пока кольцо ближе найденной вершины
+    def nearest(self, lat, lon):
+        if not len(self):
+            raise RoutingError('Empty road graph')
+        ci, cj = self._cell(lat, lon)
+        best, best_d = None, math.inf
+        ring = 0
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        while True:
+            for i in range(ci - ring, ci + ring + 1):
+                for j in range(cj - ring, cj + ring + 1):
+                    if max(abs(i - ci), abs(j - cj)) != ring:
+                        continue
+                    for node in self._cells.get((i, j), ()):
+                        d = self._heuristic(lat, lon, node)
+                        if d < best_d:
+                            best, best_d = node, d
+            # Минимальное расстояние до ячеек следующего кольца
+            ring_d = ring * self.CELL * math.radians(1) * _EARTH_R * cos_lat
+            if best is not None and ring_d > best_d:
+                return best
+            if ring > 0 and ring * self.CELL > 180:
+                return best
+            ring += 1
+
+    def _heuristic(self, lat, lon, node):
+        # Гаверсинус (нижняя оценка геодезического расстояния)
+        phi1, phi2 = math.radians(lat), math.radians(self.lats[node])
+        dphi = phi2 - phi1
+        dlmb = math.radians(self.lons[node] - lon)
+        a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+        return 2 * _EARTH_R * math.asin(min(1.0, math.sqrt(a)))
+
+    # Список индексов вершин кратчайшего пути от src до dst (A*)
+    def shortest_path(self, src, dst):
+        dst_lat, dst_lon = self.lats[dst], self.lons[dst]
+        dist = {src: 0.0}
+        prev = {}
+        heap = [(self._heuristic(dst_lat, dst_lon, src), src)]
+        closed = set()
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u == dst:
+                path = [u]
+                while u in prev:
+                    u = prev[u]
+                    path.append(u)
+                path.reverse()
+                return path
+            if u in closed:
+                continue
+            closed.add(u)
+            du = dist[u]
+            for pos in range(indptr[u], indptr[u + 1]):
+                v = indices[pos]
+                dv = du + weights[pos]
+                if dv < dist.get(v, math.inf):
+                    dist[v] = dv
+                    prev[v] = u
+                    heapq.heappush(heap, (dv + self._heuristic(dst_lat, dst_lon, v), v))
+        raise RoutingError('No route found')
+
+    def directions(self, start, end, prof):
+        path = self.shortest_path(self.nearest(*start), self.nearest(*end))
+        return encode_polyline([(self.lons[node], self.lats[node]) for node in path])
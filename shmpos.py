@@ -0,0 +1,90 @@
+import os
+import mmap
+import math
+import time
+import struct
+
+# Положение трекера в разделяемой памяти (файл в /dev/shm), фиксированный формат 64 байта:
+#   magic(4s) version(I) seq(Q) lat lon ts speed azimuth odo (6 x double), little-endian
+# seq - счетчик поколений (seqlock): нечетный, пока писатель обновляет данные.
+# Читатель повторяет чтение, если seq нечетный или изменился за время чтения.
+MAGIC = b'LOCD'
+VERSION = 1
+_HEADER = struct.Struct('<4sI')
+_SEQ = struct.Struct('<Q')
+_DATA = struct.Struct('<6d')
+_SEQ_OFFSET = _HEADER.size
+_DATA_OFFSET = _SEQ_OFFSET + _SEQ.size
+SIZE = _DATA_OFFSET + _DATA.size
+# Сколько секунд читатель ждет завершения записи (писатель мог умереть посреди нее)
+READ_TIMEOUT = 0.1
+
+
+class PosWriter:
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o664)
+        try:
+            os.ftruncate(fd, SIZE)
+            self._mm = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        magic, version = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            _SEQ.pack_into(self._mm, _SEQ_OFFSET, 0)
+            _HEADER.pack_into(self._mm, 0, MAGIC, VERSION)
+        # После перезапуска продолжаем с четного значения, чтобы читатели увидели новое поколение
+        self._seq = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0] & ~1
+
+    def write(self, lat, lon, ts, speed=0.0, azimuth=None, odo=0.0):
+        self._seq += 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+        _DATA.pack_into(self._mm, _DATA_OFFSET, lat, lon, ts, speed,
+                        math.nan if azimuth is None else azimuth, odo)
+        self._seq += 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+
+    def close(self):
+        self._mm.close()
+
+
+class PosReader:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), SIZE, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f'{path} is not a locd position file')
+
+    # Номер поколения данных: меняется при каждой записи
+    def seq(self):
+        return _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+
+    # Последнее опубликованное положение или None, если писатель еще ничего не записал
+    # или не закончил запись за timeout сек
+    def read(self, timeout=READ_TIMEOUT):
+        deadline = None
+        while True:
+            seq = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+            if seq & 1:
+                if deadline is None:
+                    deadline = time.monotonic() + timeout
+                elif time.monotonic() >= deadline:
+                    return None
+                time.sleep(0)
+                continue
+            lat, lon, ts, speed, azimuth, odo = _DATA.unpack_from(self._mm, _DATA_OFFSET)
+            if _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0] == seq:
+                break
+        if seq == 0:
+            return None
+        return {'cur_loc': (lat, lon),
+                'ts': ts,
+                'speed': speed,
+                'azimuth': None if math.isnan(azimuth) else azimuth,
+                'odo': odo,
+                'seq': seq}
+
+    def close(self):
+        self._mm.close()
@@ -0,0 +1,138 @@
+import os
+import zlib
+import struct
+
+# Полное состояние трекера на диске: снапшот + журнал.
+# Снапшот (path) пишется целиком при смене маршрута: во временный файл, fsync и rename, поэтому на диске
+# всегда либо старый, либо новый снапшот. Формат (little-endian):
+#   magic(4s) version(I) gen(Q)
+#   cur lat lon, route_start lat lon, target lat lon, speed odo sync_time (9 x double)
+#   leg legs_total n_track n_waypoints (4 x I, n_track = 0xffffffff - трека нет) prof_len(H)
+#   prof (utf-8), track (n_track x 2 double), waypoints (n_waypoints x 2 double), crc32(I) всего предыдущего
+# Журнал (path.journal) - дозапись прогресса по текущему маршруту записями фиксированного размера:
+#   gen(Q) sync_time odo speed (3 x double) crc32(I)
+# При загрузке применяется последняя целая запись журнала с gen снапшота
+MAGIC = b'LOCS'
+VERSION = 1
+_HEADER = struct.Struct('<4sIQ')
+_STATE = struct.Struct('<9d4IH')
+_POINT = struct.Struct('<2d')
+_CRC = struct.Struct('<I')
+_JOURNAL = struct.Struct('<Q3dI')
+_NO_TRACK = 0xffffffff
+
+
+def _pack_points(points):
+    return b''.join(_POINT.pack(*pnt) for pnt in points)
+
+
+def _unpack_points(data, offset, count):
+    end = offset + count * _POINT.size
+    return [tuple(pnt) for pnt in _POINT.iter_unpack(data[offset:end])], end
+
+
+def pack_state(state, gen):
+    track = state['track']
+    prof = state['prof'].encode('utf-8')
+    data = b''.join((_HEADER.pack(MAGIC, VERSION, gen),
+                     _STATE.pack(*state['cur_loc'], *state['route_start'], *state['target_loc'],
+                                 state['speed'], state['odo'], state['sync_time'],
+                                 state['leg'], state['legs_total'],
+                                 _NO_TRACK if track is None else len(track), len(state['waypoints']), len(prof)),
+                     prof,
+                     _pack_points(track or ()),
+                     _pack_points(state['waypoints'])))
+    return data + _CRC.pack(zlib.crc32(data))
+
+
+# (state, gen) из снапшота, ValueError - файл поврежден или другого формата
+def unpack_state(data):
+    if len(data) < _HEADER.size + _STATE.size + _CRC.size:
+        raise ValueError('snapshot is too short')
+    if _CRC.unpack_from(data, len(data) - _CRC.size)[0] != zlib.crc32(data[:-_CRC.size]):
+        raise ValueError('snapshot checksum mismatch')
+    magic, version, gen = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a locd snapshot')
+    values = _STATE.unpack_from(data, _HEADER.size)
+    leg, legs_total, n_track, n_waypoints, prof_len = values[9:]
+    offset = _HEADER.size + _STATE.size
+    prof = data[offset:offset + prof_len].decode('utf-8')
+    offset += prof_len
+    if n_track == _NO_TRACK:
+        track = None
+    else:
+        track, offset = _unpack_points(data, offset, n_track)
+    waypoints, offset = _unpack_points(data, offset, n_waypoints)
+    state = {'cur_loc': values[0:2],
+             'route_start': values[2:4],
+             'target_loc': values[4:6],
+             'speed': values[6],
+             'odo': values[7],
+             'sync_time': values[8],
+             'leg': leg,
+             'legs_total': legs_total,
+             'prof': prof,
+             'track': track,
+             'waypoints': waypoints}
+    return state, gen
+
+
+class SnapshotStore:
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = f'{path}.journal'
+        self.gen = 0
+        # Число записей в журнале после последнего снапшота
+        self.journal_size = 0
+        self._journal_fd = None
+
+    # Последнее сохраненное состояние (снапшот + журнал) или None
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state, self.gen = unpack_state(f.read())
+        except (OSError, ValueError):
+            return None
+        try:
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        # Недописанную последнюю запись (и записи старых поколений) пропускаем
+        for pos in range(0, len(data) - _JOURNAL.size + 1, _JOURNAL.size):
+            gen, sync_time, odo, speed, crc = _JOURNAL.unpack_from(data, pos)
+            if gen == self.gen and crc == zlib.crc32(data[pos:pos + _JOURNAL.size - _CRC.size]):
+                state.update(sync_time=sync_time, odo=odo, speed=speed)
+        return state
+
+    # Записать полный снапшот и начать журнал заново
+    def save(self, state):
+        self.gen += 1
+        data = pack_state(state, self.gen)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # Записи журнала старого поколения уже не применяются, файл только укорачиваем
+        self._close_journal()
+        self._journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o664)
+        self.journal_size = 0
+
+    # Дописать прогресс движения по маршруту последнего снапшота
+    def journal(self, sync_time, odo, speed):
+        if self._journal_fd is None:
+            self._journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o664)
+        record = _JOURNAL.pack(self.gen, sync_time, odo, speed, 0)[:-_CRC.size]
+        os.write(self._journal_fd, record + _CRC.pack(zlib.crc32(record)))
+        self.journal_size += 1
+
+    def _close_journal(self):
+        if self._journal_fd is not None:
+            os.close(self._journal_fd)
+            self._journal_fd = None
+
+    def close(self):
+        self._close_journal()